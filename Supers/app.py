@@ -3,6 +3,8 @@ from __future__ import annotations
 import os
 import asyncio
 import threading
+from time import monotonic
+from typing import Optional, Tuple
 from flask import Flask, jsonify, request, current_app
 
 from crawler.core import run_all
@@ -14,6 +16,17 @@ app = Flask(__name__)
 
 logger.info("startup version=%s", VERSION)
 
+# One event loop for the whole process, running in a background thread. Async state
+# kept between requests (the asyncpg pool) is bound to the loop that created it, so
+# every request runs its coroutines here instead of in a fresh asyncio.run() loop.
+_loop = asyncio.new_event_loop()
+threading.Thread(target=_loop.run_forever, daemon=True, name="asyncio-loop").start()
+
+
+def _run_async(coro):
+    """Run coro on the shared event loop and block the calling thread until it is done."""
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
 
 def _run_crawler_background(retailers, group_for_log):
     """
@@ -34,7 +47,7 @@ def _run_crawler_background(retailers, group_for_log):
         start = perf_counter()
         
         # Run the crawler to completion
-        results = asyncio.run(run_all(retailers))
+        results = _run_async(run_all(retailers))
         
         duration = perf_counter() - start
         
@@ -71,21 +84,29 @@ def version():
 
 
 
+# /retailers summary, rebuilt at most every RETAILERS_TTL seconds: (built at, payload)
+RETAILERS_TTL = 300
+_retailers_summary: Optional[Tuple[float, dict]] = None
+
+
 @app.get("/retailers")
 def retailers_debug():
-    cfg = load_retailers_config()
-    retailers = cfg.get("retailers", [])
-    return jsonify({
-        "total_retailers": len(retailers),
-        "sample": [
-            {
-                "id": r.get("id"),
-                "name": r.get("name"),
-                "enabled": r.get("enabled", True),
-                "sources": [s.get("url") for s in r.get("sources", [])][:3]
-            } for r in retailers[:5]
-        ]
-    }), 200
+    global _retailers_summary
+    if _retailers_summary is None or monotonic() - _retailers_summary[0] >= RETAILERS_TTL:
+        cfg = load_retailers_config()
+        retailers = cfg.get("retailers", [])
+        _retailers_summary = (monotonic(), {
+            "total_retailers": len(retailers),
+            "sample": [
+                {
+                    "id": r.get("id"),
+                    "name": r.get("name"),
+                    "enabled": r.get("enabled", True),
+                    "sources": [s.get("url") for s in r.get("sources", [])][:3]
+                } for r in retailers[:5]
+            ]
+        })
+    return jsonify(_retailers_summary[1]), 200
 
 
 @app.route("/trigger", methods=["GET", "POST"])
@@ -244,7 +265,7 @@ def run():
         )
 
         # run_all is async; run it to completion in this process
-        results = asyncio.run(run_all(retailers))
+        results = _run_async(run_all(retailers))
 
         duration = perf_counter() - start
         logger.info(
@@ -304,8 +325,7 @@ def __smoke():
     """Health check endpoint - verifies database connectivity"""
     try:
         from crawler.db import get_pool
-        import asyncio
-        pool = asyncio.run(get_pool())
+        pool = _run_async(get_pool())
         if pool:
             return jsonify(ok=True, message="Database connection available")
         else:
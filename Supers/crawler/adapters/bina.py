@@ -11,24 +11,99 @@ from playwright.async_api import Page, Frame
 from .. import logger
 from ..models import RetailerResult
 from ..archive_utils import sniff_kind, md5_hex
-from ..download import fetch_url
+from ..download import download_links
 from ..parsers import parse_from_blob
 from ..memory_utils import log_memory
+from ..playwright_helpers import debug_screenshot
 from .generic import collect_links_on_page
 
 
 
+# Download() buttons (primary) or direct archive links (fallback); waited on instead of "networkidle"
+DOWNLOADS_READY_SELECTOR = (
+    "button[onclick*='Download'], button[onclick*='download'], a[href*='.gz'], a[href*='.zip']"
+)
+
+ARCHIVE_CONTENT_TYPES = (
+    "application/zip", "application/x-zip-compressed", "application/gzip",
+    "application/x-gzip", "application/octet-stream",
+)
+
+# Response URLs worth capturing: archive extensions, or feed keywords (then checked by content type)
+_ARCHIVE_URL_RE = re.compile(r"\.(?:zip|gz)", re.IGNORECASE | re.ASCII)
+_FEED_KEYWORD_RE = re.compile(r"pricefull|promo|stores|download", re.IGNORECASE | re.ASCII)
+
 TAB_CANDIDATES = ["מחיר מלא", "Price Full", "PriceFull", "Promo", "Promotions", "Stores", "חנויות"]
 
+# Download('name') buttons inside table rows: filename, own-row date, position among all buttons
+_DOWNLOAD_BUTTONS_JS = """
+    () => {
+        const buttons = [];
+        // Row index of every table row, looked up per button instead of re-queried
+        const rowIndexes = new Map();
+        document.querySelectorAll('table tr, tbody tr').forEach((r, i) => rowIndexes.set(r, i));
+
+        // Every Download() button in document order: its position is exactly what the
+        // Python side's locator(...).nth() indexes
+        const btns = document.querySelectorAll("button[onclick*='Download'], button[onclick*='download']");
+        btns.forEach((btn, buttonIndex) => {
+            // The button's own (innermost) row, so a button in a nested table gets its
+            // own row's date; buttons outside a table row are skipped
+            const row = btn.closest('tr');
+            if (!row) return;
+
+            // Extract filename from onclick
+            const onclick = btn.getAttribute('onclick') || '';
+            const match = onclick.match(/Download\\(['"]([^'"]+)['"]\\)/i);
+            if (!match) return;
+
+            const filename = match[1];
+            if (!filename.endsWith('.gz') && !filename.endsWith('.zip')) return;
+
+            // Try to find date in this row - look for DD/MM/YYYY pattern (Bina format)
+            // Dates are in format: DD/MM/YYYY HH:MM (e.g., "25/11/2025 01:24")
+            const rowText = row.textContent || '';
+            const dateMatch = rowText.match(/(\\d{1,2}\\/\\d{1,2}\\/\\d{4})/);
+            const dateStr = dateMatch ? dateMatch[1] : null;  // Extract just DD/MM/YYYY part
+
+            // Prefer the date in the last cell that has one (תאריך column). Cells are part of
+            // the row text, so they are only scanned when the row has a date at all, from
+            // the end, stopping at the first hit. Only the row's own cells, not nested ones.
+            let cellDate = null;
+            const cells = dateMatch ? row.cells : [];
+            for (let i = cells.length - 1; i >= 0 && !cellDate; i--) {
+                // Match DD/MM/YYYY format (Bina uses this format)
+                const cellDateMatch = (cells[i].textContent || '').match(/(\\d{1,2}\\/\\d{1,2}\\/\\d{4})/);
+                if (cellDateMatch) {
+                    cellDate = cellDateMatch[1];  // Extract just DD/MM/YYYY part (without time)
+                }
+            }
+
+            buttons.push({
+                filename: filename,
+                onclick: onclick,
+                id: btn.id || null,
+                text: btn.textContent?.trim() || '',
+                date: cellDate || dateStr,
+                rowIndex: rowIndexes.has(row) ? rowIndexes.get(row) : null,
+                buttonIndex: buttonIndex
+            });
+        });
+
+        return buttons;
+    }
+"""
+
 
 async def bina_get_content_frame(page: Page, retailer_id: str = "unknown") -> Frame:
     """
     Get the content frame. Most Bina sites don't use iframes - they're direct pages.
     This function now just returns the main frame after ensuring page is loaded.
     """
-    # Wait for page to fully load
-    await page.wait_for_load_state("networkidle", timeout=10000)
-    await page.wait_for_timeout(1000)  # Additional wait for dynamic content
+    # Wait for the document (and its iframes) to be parsed; not network idle, which
+    # portals with polling scripts never reach. Callers wait for the download controls.
+    with contextlib.suppress(Exception):
+        await page.wait_for_load_state("domcontentloaded", timeout=10000)
     
     # Check if there are any iframes (some sites might still use them)
     frames = page.frames
@@ -84,57 +159,7 @@ async def bina_collect_download_buttons(page: Page, frame: Frame, filter_today:
         
         # Strategy: Extract buttons WITH their row dates from the table
         # The table structure has rows with date cells and download buttons
-        button_data = await frame.evaluate("""
-            () => {
-                const buttons = [];
-                // Find all table rows (tr elements)
-                const rows = Array.from(document.querySelectorAll('table tr, tbody tr'));
-                
-                rows.forEach((row, rowIndex) => {
-                    // Find download button in this row
-                    const btn = row.querySelector("button[onclick*='Download'], button[onclick*='download']");
-                    if (!btn) return;
-                    
-                    // Extract filename from onclick
-                    const onclick = btn.getAttribute('onclick') || '';
-                    const match = onclick.match(/Download\\(['"]([^'"]+)\\)/i);
-                    if (!match) return;
-                    
-                    const filename = match[1];
-                    if (!filename.endsWith('.gz') && !filename.endsWith('.zip')) return;
-                    
-                    // Try to find date in this row - look for DD/MM/YYYY pattern (Bina format)
-                    // Dates are in format: DD/MM/YYYY HH:MM (e.g., "25/11/2025 01:24")
-                    const rowText = row.textContent || '';
-                    const dateMatch = rowText.match(/(\\d{1,2}\\/\\d{1,2}\\/\\d{4})/);
-                    const dateStr = dateMatch ? dateMatch[1] : null;  // Extract just DD/MM/YYYY part
-                    
-                    // Also try to find date in specific cells (תאריך column)
-                    let cellDate = null;
-                    const cells = row.querySelectorAll('td');
-                    cells.forEach(cell => {
-                        const cellText = cell.textContent || '';
-                        // Match DD/MM/YYYY format (Bina uses this format)
-                        const cellDateMatch = cellText.match(/(\\d{1,2}\\/\\d{1,2}\\/\\d{4})/);
-                        if (cellDateMatch) {
-                            cellDate = cellDateMatch[1];  // Extract just DD/MM/YYYY part (without time)
-                        }
-                    });
-                    
-                    buttons.push({
-                        filename: filename,
-                        onclick: onclick,
-                        id: btn.id || null,
-                        text: btn.textContent?.trim() || '',
-                        date: cellDate || dateStr,
-                        rowIndex: rowIndex,
-                        buttonIndex: buttons.length  // Index among buttons found
-                    });
-                });
-                
-                return buttons;
-            }
-        """)
+        button_data = await frame.evaluate(_DOWNLOAD_BUTTONS_JS)
         
         for btn_info in button_data or []:
             filename = btn_info.get('filename')
@@ -185,21 +210,20 @@ async def bina_collect_gz_links(page: Page) -> List[str]:
     selector = "a[href$='.gz'], a[href*='.gz'], a[href$='.zip'], a[href*='.zip']"
     hrefs: Set[str] = set()
     
-    # Scan ALL frames (main + child frames) without waiting for selector first
-    for frame in page.frames:
-        try:
-            count = await frame.locator(selector).count()
-            if count == 0:
-                continue
-            
-            # Extract links from this frame
-            vals = await frame.eval_on_selector_all(selector, "els => els.map(a => a.href)")
-            for h in vals or []:
-                if h:
-                    hrefs.add(h)
-        except Exception as e:
-            logger.debug("bina.frame_scan_error frame=%s error=%s", frame.url or "unknown", str(e))
+    # Scan ALL frames (main + child frames) without waiting for selector first;
+    # one round trip per frame, all frames at once (a frame without matches just returns [])
+    frames = page.frames
+    frame_results = await asyncio.gather(
+        *(frame.eval_on_selector_all(selector, "els => els.map(a => a.href)") for frame in frames),
+        return_exceptions=True,
+    )
+    for frame, vals in zip(frames, frame_results):
+        if isinstance(vals, Exception):
+            logger.debug("bina.frame_scan_error frame=%s error=%s", frame.url or "unknown", str(vals))
             continue
+        for h in vals or []:
+            if h:
+                hrefs.add(h)
     
     if not hrefs:
         return []
@@ -235,95 +259,103 @@ async def bina_collect_links(page: Page, retailer_id: str = "unknown") -> List[s
     1. Look for direct <a> links with .gz/.zip extensions
     2. Network capture (if buttons trigger downloads)
     """
-    frame = await bina_get_content_frame(page, retailer_id)
-    
-    # Wait for page content to load (especially table with download buttons)
-    await page.wait_for_load_state("networkidle", timeout=10000)
-    await page.wait_for_timeout(2000)  # Wait for table to render
-    
-    # Strategy 1: Find Download() buttons and extract filenames (filtered to today)
-    # This is the PRIMARY strategy based on the actual site structure
-    download_buttons = await bina_collect_download_buttons(page, frame, filter_today=True)
-    
-    if download_buttons:
-        # Return filenames as "pseudo-links" - they'll be handled by click fallback
-        # Format: "download_button:filename.gz" to distinguish from real URLs
-        pseudo_links = [f"download_button:{btn['filename']}" for btn in download_buttons]
-        logger.info("bina.download_buttons retailer=%s count=%d (today only)", retailer_id, len(pseudo_links))
-        return pseudo_links
-    
-    # Strategy 2: Try to click tabs/filters to reveal download buttons
-    tab_clicked = False
-    for candidate in ["מחיר מלא", "Price Full", "PriceFull", "מחירון", "Prices"]:
-        try:
-            if await frame.get_by_text(candidate, exact=False).count() > 0:
-                await frame.get_by_text(candidate, exact=False).first.click(timeout=2000)
-                logger.debug("bina.tab_clicked retailer=%s tab=%s", retailer_id, candidate)
-                tab_clicked = True
-                await page.wait_for_timeout(2000)  # Wait for table to update
-                
-                # Check again for download buttons after tab click
-                download_buttons = await bina_collect_download_buttons(page, frame)
-                if download_buttons:
-                    pseudo_links = [f"download_button:{btn['filename']}" for btn in download_buttons]
-                    logger.info("bina.download_buttons_after_tab retailer=%s count=%d", retailer_id, len(pseudo_links))
-                    return pseudo_links
-                break
-        except Exception:
-            continue
-    
-    # Strategy 3: Look for direct <a> links with .gz/.zip (fallback)
-    hrefs = await bina_collect_gz_links(page)
-    if hrefs:
-        logger.debug("bina.dom_links retailer=%s count=%d", retailer_id, len(hrefs))
-        return hrefs
-    
-    # Strategy 4: Network capture (if buttons trigger downloads via AJAX)
-    logger.debug("bina.network_capture retailer=%s starting", retailer_id)
+    # Listen for archive responses for the whole discovery (tab clicks included),
+    # so files fetched via AJAX are captured without extra clicks
     captured: Set[str] = set()
     
     def _on_response(resp):
         try:
-            url = (getattr(resp, "url", "") or "").lower()
-            if any(p in url for p in (".zip", ".gz", "pricefull", "promo", "stores", "download")):
+            url = getattr(resp, "url", "") or ""
+            if _ARCHIVE_URL_RE.search(url):
                 captured.add(resp.url)
+            elif _FEED_KEYWORD_RE.search(url):
+                # Keyword-only URLs must actually serve an archive, not a page/script
+                ctype = (resp.headers.get("content-type") or "").lower()
+                if ctype.startswith(ARCHIVE_CONTENT_TYPES):
+                    captured.add(resp.url)
         except Exception:
             pass
     
     page.on("response", _on_response)
-    
-    # Try clicking a download button to trigger network capture
     try:
-        download_btn = frame.locator("button[onclick*='Download']").first
-        if await download_btn.count() > 0:
-            await download_btn.click(timeout=5000)
-            await page.wait_for_timeout(2000)
-    except Exception:
-        pass
-    
-    page.remove_listener("response", _on_response)
-    
-    if captured:
-        logger.debug("bina.network_captured retailer=%s count=%d", retailer_id, len(captured))
-        return list(captured)
-    
-    # No links found - log diagnostic info
-    logger.warning(
-        "bina.no_links retailer=%s url=%s frames=%d tab_clicked=%s", 
-        retailer_id,
-        page.url,
-        len(page.frames),
-        tab_clicked
-    )
-    
-    # Take screenshot for debugging
-    with contextlib.suppress(Exception):
-        await page.screenshot(
-            path=f"screenshots/{retailer_id}_bina_no_links.png",
-            full_page=True,
+        frame = await bina_get_content_frame(page, retailer_id)
+        
+        # Wait for page content to load (especially table with download buttons);
+        # fixed render time only when the controls never showed up
+        try:
+            await page.wait_for_selector(DOWNLOADS_READY_SELECTOR, timeout=10000)
+        except Exception:
+            await page.wait_for_timeout(2000)  # Wait for table to render
+        
+        # Strategy 1: Find Download() buttons and extract filenames (filtered to today)
+        # This is the PRIMARY strategy based on the actual site structure
+        download_buttons = await bina_collect_download_buttons(page, frame, filter_today=True)
+        
+        if download_buttons:
+            # Return filenames as "pseudo-links" - they'll be handled by click fallback
+            # Format: "download_button:filename.gz" to distinguish from real URLs
+            pseudo_links = [f"download_button:{btn['filename']}" for btn in download_buttons]
+            logger.info("bina.download_buttons retailer=%s count=%d (today only)", retailer_id, len(pseudo_links))
+            return pseudo_links
+        
+        # Strategy 2: Try to click tabs/filters to reveal download buttons
+        tab_clicked = False
+        for candidate in ["מחיר מלא", "Price Full", "PriceFull", "מחירון", "Prices"]:
+            try:
+                if await frame.get_by_text(candidate, exact=False).count() > 0:
+                    await frame.get_by_text(candidate, exact=False).first.click(timeout=2000)
+                    logger.debug("bina.tab_clicked retailer=%s tab=%s", retailer_id, candidate)
+                    tab_clicked = True
+                    await page.wait_for_timeout(2000)  # Wait for table to update
+                
+                    # Check again for download buttons after tab click
+                    download_buttons = await bina_collect_download_buttons(page, frame)
+                    if download_buttons:
+                        pseudo_links = [f"download_button:{btn['filename']}" for btn in download_buttons]
+                        logger.info("bina.download_buttons_after_tab retailer=%s count=%d", retailer_id, len(pseudo_links))
+                        return pseudo_links
+                    break
+            except Exception:
+                continue
+        
+        # Strategy 3: Look for direct <a> links with .gz/.zip (fallback)
+        hrefs = await bina_collect_gz_links(page)
+        if hrefs:
+            logger.debug("bina.dom_links retailer=%s count=%d", retailer_id, len(hrefs))
+            return hrefs
+        
+        # Strategy 4: Network capture (if buttons trigger downloads via AJAX)
+        logger.debug("bina.network_capture retailer=%s clicking", retailer_id)
+        
+        # Try clicking a download button to trigger network capture
+        try:
+            download_btn = frame.locator("button[onclick*='Download']").first
+            if await download_btn.count() > 0:
+                await download_btn.click(timeout=5000)
+                await page.wait_for_timeout(2000)
+        except Exception:
+            pass
+        
+        if captured:
+            logger.debug("bina.network_captured retailer=%s count=%d", retailer_id, len(captured))
+            return list(captured)
+        
+        # No links found - log diagnostic info
+        logger.warning(
+            "bina.no_links retailer=%s url=%s frames=%d tab_clicked=%s", 
+            retailer_id,
+            page.url,
+            len(page.frames),
+            tab_clicked
         )
-    
-    return []
+        
+        # Take screenshot for debugging (only when DEBUG_SCREENSHOTS is on)
+        with contextlib.suppress(Exception):
+            await debug_screenshot(page, f"{retailer_id}_bina_no_links")
+        
+        return []
+    finally:
+        page.remove_listener("response", _on_response)
 
 
 async def bina_fallback_click_downloads(
@@ -379,7 +411,7 @@ async def bina_fallback_click_downloads(
         
         logger.info("discovery retailer=%s adapter=bina buttons_to_click=%d", retailer_id, len(buttons_to_click))
         
-        for btn_idx, btn_info in buttons_to_click:
+        for i, (btn_idx, btn_info) in enumerate(buttons_to_click):
             try:
                 filename_expected = btn_info.get('filename', 'unknown')
                 date_str = btn_info.get('date', 'unknown')
@@ -425,7 +457,7 @@ async def bina_fallback_click_downloads(
                 total += 1
                 
                 # Throttle between clicks
-                if throttle_ms and btn_idx < len(buttons_to_click) - 1:
+                if throttle_ms and i < len(buttons_to_click) - 1:
                     await asyncio.sleep(throttle_ms / 1000)
                 
             except Exception as e:
@@ -456,7 +488,7 @@ async def bina_fallback_click_downloads(
             if max_files > 0:
                 buttons_to_click = buttons_to_click[:max_files]
             
-            for btn_idx, btn_info in buttons_to_click:
+            for i, (btn_idx, btn_info) in enumerate(buttons_to_click):
                 try:
                     filename_expected = btn_info.get('filename', 'unknown')
                     async with page.expect_download(timeout=20000) as dl_info:
@@ -488,7 +520,7 @@ async def bina_fallback_click_downloads(
                     
                     total += 1
                     
-                    if throttle_ms and btn_idx < len(buttons_to_click) - 1:
+                    if throttle_ms and i < len(buttons_to_click) - 1:
                         await asyncio.sleep(throttle_ms / 1000)
                     
                 except Exception as e:
@@ -574,9 +606,11 @@ async def bina_adapter(page: Page, source: dict, retailer_id: str, seen_hashes:
     try:
         # Navigate to page with proper wait conditions
         await page.goto(source.get("url", ""), wait_until="domcontentloaded", timeout=60000)
-        await page.wait_for_load_state("networkidle", timeout=15000)
-        # Additional wait for dynamic content
-        await page.wait_for_timeout(2000)
+        try:
+            await page.wait_for_selector(DOWNLOADS_READY_SELECTOR, timeout=15000)
+        except Exception:
+            # Additional wait for dynamic content, only when the controls never showed up
+            await page.wait_for_timeout(2000)
         
         # Collect download links - use Bina-specific collection FIRST (handles frames properly)
         log_memory(logger, f"bina.before_collect_links retailer={retailer_id}")
@@ -646,44 +680,7 @@ async def bina_adapter(page: Page, source: dict, retailer_id: str, seen_hashes:
         
         # Process each REAL link (skip pseudo-links - they're already handled above)
         log_memory(logger, f"bina.before_downloads retailer={retailer_id} links={len(real_links)}")
-        for link in real_links:
-            filename = link.split('/')[-1] or link  # Fallback for error logging
-            try:
-                data, resp, filename = await fetch_url(page, link)
-                if data is None:
-                    continue
-                kind = sniff_kind(data)
-                md5_hash = md5_hex(data)
-                
-                # Check for duplicates
-                if md5_hash in seen_hashes:
-                    result.skipped_dupes += 1
-                    continue
-                
-                # Normalize filename for name-based dedupe
-                normalized_name = f"{retailer_id}/{filename.lower()}"
-                if normalized_name in seen_names:
-                    result.skipped_dupes += 1
-                    continue
-                
-                # Add to seen sets
-                seen_hashes.add(md5_hash)
-                seen_names.add(normalized_name)
-                
-                # Unified parse (logs file.downloaded, extracts, parses, logs file.processed)
-                await parse_from_blob(data, filename, retailer_id, run_id)
-                
-                # Update counters based on sniffed kind (not filename extension)
-                if kind == "zip":
-                    result.zips += 1
-                elif kind == "gz":
-                    result.gz += 1
-                result.files_downloaded += 1
-                
-            except Exception as e:
-                result.errors.append(f"download_error:{link}:{e}")
-                logger.error("download.failed retailer=%s link=%s file=%s err=%s", retailer_id, link, filename, str(e))
-                continue
+        await download_links(page, real_links, retailer_id, seen_hashes, seen_names, run_id, result)
         
         log_memory(logger, f"bina.after_downloads retailer={retailer_id} downloaded={result.files_downloaded}")
                 
@@ -1,20 +1,34 @@
 # crawler/adapters/generic.py
 from __future__ import annotations
-import os
+import asyncio
+import contextlib
 import re
-from datetime import datetime, timezone
+from datetime import datetime
 from typing import List, Set, Optional
 
 from playwright.async_api import Page
 
 from .. import logger
-from ..constants import SCREENSHOTS_DIR, DEFAULT_DOWNLOAD_SUFFIXES
+from ..constants import DEFAULT_DOWNLOAD_SUFFIXES
 from ..models import RetailerResult
-from ..archive_utils import sniff_kind, md5_hex
-from ..download import fetch_url
-from ..parsers import parse_from_blob
-from ..utils import ensure_dirs, looks_like_price_file
+from ..download import download_links
+from ..utils import looks_like_price_file
 from ..memory_utils import log_memory
+from ..playwright_helpers import debug_screenshot
+
+
+# Anything that looks like a downloadable price file; waited on instead of "networkidle"
+DOWNLOAD_LINK_SELECTOR = "a[href*='.gz'], a[href*='.zip'], a[href*='.xml'], a[href*='download']"
+
+# Common date patterns in URLs/filenames
+DATE_PATTERNS = tuple(re.compile(p) for p in (
+    r'(\d{4}-\d{2}-\d{2})',  # YYYY-MM-DD (ISO format)
+    r'(\d{2}-\d{2}-\d{4})',  # DD-MM-YYYY
+    r'(\d{4}\d{2}\d{2})',    # YYYYMMDD
+    r'(\d{2}/\d{2}/\d{4})',  # DD/MM/YYYY
+    r'(\d{4}/\d{2}/\d{2})',  # YYYY/MM/DD
+    r'(\d{2}\.\d{2}\.\d{4})', # DD.MM.YYYY
+))
 
 
 def extract_date_from_link(href: str, link_text: str = "") -> Optional[str]:
@@ -22,19 +36,9 @@ def extract_date_from_link(href: str, link_text: str = "") -> Optional[str]:
     Extract date from URL or link text.
     Returns date string in YYYY-MM-DD format if found, None otherwise.
     """
-    # Common date patterns in URLs/filenames
-    date_patterns = [
-        r'(\d{4}-\d{2}-\d{2})',  # YYYY-MM-DD (ISO format)
-        r'(\d{2}-\d{2}-\d{4})',  # DD-MM-YYYY
-        r'(\d{4}\d{2}\d{2})',    # YYYYMMDD
-        r'(\d{2}/\d{2}/\d{4})',  # DD/MM/YYYY
-        r'(\d{4}/\d{2}/\d{2})',  # YYYY/MM/DD
-        r'(\d{2}\.\d{2}\.\d{4})', # DD.MM.YYYY
-    ]
-    
     # Search in URL first
-    for pattern in date_patterns:
-        match = re.search(pattern, href)
+    for pattern in DATE_PATTERNS:
+        match = pattern.search(href)
         if match:
             date_str = match.group(1)
             # Normalize to YYYY-MM-DD format
@@ -62,8 +66,8 @@ def extract_date_from_link(href: str, link_text: str = "") -> Optional[str]:
     
     # Search in link text if URL didn't have a date
     if link_text:
-        for pattern in date_patterns:
-            match = re.search(pattern, link_text)
+        for pattern in DATE_PATTERNS:
+            match = pattern.search(link_text)
             if match:
                 date_str = match.group(1)
                 try:
@@ -118,7 +122,7 @@ async def collect_links_on_page(page: Page, patterns: Optional[List[str]] = None
         "a[href*='.zip?' i]",
     ]
     # Build suffix selectors from patterns
-    pat = [p.lower() for p in (patterns or DEFAULT_DOWNLOAD_SUFFIXES)]
+    pat = tuple(p.lower() for p in (patterns or DEFAULT_DOWNLOAD_SUFFIXES))
     for p in pat:
         selectors.append(f"a[href$='{p}' i]")
         selectors.append(f"a[href*='{p}?' i]")
@@ -126,49 +130,64 @@ async def collect_links_on_page(page: Page, patterns: Optional[List[str]] = None
     hrefs = set()
     today_str = datetime.now().strftime("%Y-%m-%d")
     
-    # Scan ALL frames (main + child frames) - many sites use iframes
-    for frame in page.frames:
-        for sel in selectors:
-            try:
-                count = await frame.locator(sel).count()
-                if count == 0:
-                    continue
-                
-                # Extract both href and text for date filtering
-                link_data = await frame.eval_on_selector_all(sel, """
-                    els => els.map(a => ({
-                        href: a.href,
-                        text: a.textContent || ''
-                    }))
-                """)
-                
-                for link_info in (link_data or []):
-                    h = link_info.get('href')
-                    link_text = link_info.get('text', '')
-                    
-                    if not h:
-                        continue
-                    
-                    if not (looks_like_price_file(h) or h.lower().endswith(tuple(pat))):
-                        continue
-                    
-                    # Date filtering
-                    if filter_today:
-                        date_str = extract_date_from_link(h, link_text)
-                        if date_str:
-                            if not is_today(date_str):
-                                logger.debug(f"generic.skip_not_today url={h} date={date_str} today={today_str}")
-                                continue
-                        else:
-                            # If no date found, skip (conservative approach)
-                            logger.debug(f"generic.skip_no_date url={h}")
-                            continue
-                    
-                    hrefs.add(h)
-            except Exception:
-                # Frame scan failed for this selector, continue to next
+    # Scan ALL frames (main + child frames) - many sites use iframes.
+    # One selector list per frame: a single browser round trip returns every
+    # candidate anchor (each at most once, in document order). All frames are
+    # queried at once; results are still handled in frame order.
+    selector = ", ".join(selectors)
+    # Extract both href and text for date filtering
+    links_js = """
+        els => els.map(a => ({
+            href: a.href,
+            text: a.textContent || ''
+        }))
+    """
+
+    async def frame_links(frame) -> List[dict]:
+        try:
+            return await frame.eval_on_selector_all(selector, links_js)
+        except Exception:
+            # One selector the browser rejects (e.g. a bad configured pattern) fails the
+            # whole list; query them one by one so only that selector's links are lost
+            results = await asyncio.gather(
+                *(frame.eval_on_selector_all(sel, links_js) for sel in selectors), return_exceptions=True
+            )
+            ok = [r for r in results if not isinstance(r, Exception)]
+            if not ok:
+                raise
+            return [link for r in ok for link in r]
+
+    frame_results = await asyncio.gather(*(frame_links(frame) for frame in page.frames), return_exceptions=True)
+    for link_data in frame_results:
+        if isinstance(link_data, Exception):
+            # Frame scan failed (e.g. detached), continue to next frame
+            continue
+
+        for link_info in (link_data or []):
+            h = link_info.get('href')
+            link_text = link_info.get('text', '')
+
+            # The same href can appear on several anchors; only keep it once
+            if not h or h in hrefs:
                 continue
-    
+
+            if not (h.lower().endswith(pat) or looks_like_price_file(h)):
+                continue
+
+            # Date filtering
+            if filter_today:
+                date_str = extract_date_from_link(h, link_text)
+                if date_str:
+                    if not is_today(date_str):
+                        logger.debug(f"generic.skip_not_today url={h} date={date_str} today={today_str}")
+                        continue
+                else:
+                    # If no date found, skip (conservative approach)
+                    logger.debug(f"generic.skip_no_date url={h}")
+                    continue
+
+            hrefs.add(h)
+
     return sorted(hrefs)
 
 
@@ -184,9 +203,12 @@ async def generic_adapter(page: Page, source: dict, retailer_id: str, seen_hashe
     try:
         # Navigate to page with proper wait conditions
         await page.goto(source.get("url", ""), wait_until="domcontentloaded", timeout=60000)
-        await page.wait_for_load_state("networkidle", timeout=15000)
-        # Additional wait for dynamic content
-        await page.wait_for_timeout(2000)
+        # Wait for the first download link rather than network idle (analytics/polling keep the network busy)
+        try:
+            await page.wait_for_selector(DOWNLOAD_LINK_SELECTOR, timeout=15000)
+        except Exception:
+            # Additional wait for dynamic content, only when no link showed up
+            await page.wait_for_timeout(2000)
         
         # Collect download links with retry logic (filtered to today's date)
         log_memory(logger, f"generic.before_collect_links retailer={retailer_id}")
@@ -196,65 +218,26 @@ async def generic_adapter(page: Page, source: dict, retailer_id: str, seen_hashe
         
         # If no links found, retry with additional wait
         if not links:
-            await page.wait_for_load_state("networkidle", timeout=8000)
+            with contextlib.suppress(Exception):
+                await page.wait_for_selector(DOWNLOAD_LINK_SELECTOR, timeout=8000)
             await page.wait_for_timeout(800)
             links = await collect_links_on_page(page, patterns, filter_today=filter_today)
         
         log_memory(logger, f"generic.after_collect_links retailer={retailer_id} count={len(links)}")
         result.links_found = len(links)
         
-        # If still no links, take screenshot and log
+        # If still no links, log (and take a screenshot when DEBUG_SCREENSHOTS is on)
         if not links:
             result.reasons.append("no_dom_links")
-            ensure_dirs(SCREENSHOTS_DIR)
-            ts = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
-            fname = f"{retailer_id}_generic_no_links_{ts}.png"
-            await page.screenshot(path=os.path.join(SCREENSHOTS_DIR, fname), full_page=True)
-            logger.warning(f"[{retailer_id}] No links found at {page.url}. Saved screenshot: {fname}")
+            fname = await debug_screenshot(page, f"{retailer_id}_generic_no_links")
+            logger.warning(f"[{retailer_id}] No links found at {page.url}. Screenshot: {fname or 'disabled'}")
         
         filter_status = "today only" if filter_today else "all dates"
         logger.info("links.discovered slug=%s adapter=generic count=%d ({})", retailer_id, len(links), filter_status)
         
         # Process each link
         log_memory(logger, f"generic.before_downloads retailer={retailer_id} links={len(links)}")
-        for link in links:
-            filename = link.split('/')[-1] or link  # Fallback for error logging
-            try:
-                data, resp, filename = await fetch_url(page, link)
-                if data is None:
-                    continue
-                kind = sniff_kind(data)
-                md5_hash = md5_hex(data)
-                
-                # Check for duplicates
-                if md5_hash in seen_hashes:
-                    result.skipped_dupes += 1
-                    continue
-                
-                # Normalize filename for name-based dedupe
-                normalized_name = f"{retailer_id}/{filename.lower()}"
-                if normalized_name in seen_names:
-                    result.skipped_dupes += 1
-                    continue
-                
-                # Add to seen sets
-                seen_hashes.add(md5_hash)
-                seen_names.add(normalized_name)
-                
-                # Unified parse (logs file.downloaded, extracts, parses, logs file.processed)
-                await parse_from_blob(data, filename, retailer_id, run_id)
-                
-                # Update counters based on sniffed kind (not filename extension)
-                if kind == "zip":
-                    result.zips += 1
-                elif kind == "gz":
-                    result.gz += 1
-                result.files_downloaded += 1
-                
-            except Exception as e:
-                result.errors.append(f"download_error:{link}:{e}")
-                logger.error("download.failed retailer=%s link=%s file=%s err=%s", retailer_id, link, filename, str(e))
-                continue
+        await download_links(page, links, retailer_id, seen_hashes, seen_names, run_id, result)
         
         log_memory(logger, f"generic.after_downloads retailer={retailer_id} downloaded={result.files_downloaded}")
                 
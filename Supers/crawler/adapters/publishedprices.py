@@ -1,21 +1,97 @@
 # crawler/adapters/publishedprices.py
 from __future__ import annotations
+import contextlib
 import json
 from datetime import datetime, timezone
 from typing import Dict, List, Optional, Set
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlsplit
 
 from playwright.async_api import Page
 
 from .. import logger
 from ..constants import DEFAULT_DOWNLOAD_SUFFIXES
 from ..models import RetailerResult
-from ..archive_utils import sniff_kind, md5_hex
-from ..download import fetch_url
-from ..parsers import parse_from_blob
+from ..download import download_links
 from ..utils import looks_like_price_file
 
 
+# Login form controls as (selector, button text) candidates, best first. The text stands in for
+# Playwright's :has-text, which plain DOM queries don't support
+USERNAME_CANDIDATES = [("input[name='username']", None), ("#username", None),
+                       ("input[name='Email']", None), ("input[type='email']", None)]
+PASSWORD_CANDIDATES = [("input[name='password']", None), ("#password", None), ("input[type='password']", None)]
+SUBMIT_CANDIDATES = [
+    ("button[type='submit']", None),
+    ("input[type='submit']", None),
+    ("button", "כניסה"),
+    ("button", "Login"),
+    ("form button", None),  # Any button in form, only if nothing specific matched
+]
+# Any username field, to wait for the form
+USERNAME_SELECTOR = ", ".join(sel for sel, _ in USERNAME_CANDIDATES)
+# Control tagged by _LOGIN_FIELDS_JS for a role
+LOGIN_FIELD_SELECTOR = "[data-login-field='%s']"
+
+# Pick each login control in one round trip: the first candidate (in list order, not the DOM
+# order a union selector's .first would use) that matches is tagged with data-login-field
+_LOGIN_FIELDS_JS = """
+    (candidates) => {
+        document.querySelectorAll('[data-login-field]').forEach(e => e.removeAttribute('data-login-field'));
+        const found = {};
+        for (const [role, list] of Object.entries(candidates)) {
+            for (const [selector, text] of list) {
+                const el = Array.from(document.querySelectorAll(selector)).find(
+                    e => !text || (e.textContent || '').toLowerCase().includes(text.toLowerCase()));
+                if (el) {
+                    el.setAttribute('data-login-field', role);
+                    found[role] = text ? `${selector} "${text}"` : selector;
+                    break;
+                }
+            }
+        }
+        return found;
+    }
+"""
+
+# File manager rows with a downloadable file (or the DataTables "no data" row)
+FILE_ROWS_SELECTOR = (
+    "table tr a[href*='.gz'], table tr a[href*='.zip'], table tr a[href*='.xml'], .dataTables_empty"
+)
+
+# File manager rows with a download link: href, row date, filename
+_FILE_ROWS_JS = """
+    () => {
+        const links = [];
+        // Find all table rows
+        const rows = Array.from(document.querySelectorAll('table tr, tbody tr'));
+
+        rows.forEach((row) => {
+            // Find download link in this row
+            const link = row.querySelector('a[href*=".gz"], a[href*=".zip"], a[href*=".xml"]');
+            if (!link) return;
+
+            const href = link.getAttribute('href');
+            if (!href) return;
+
+            // Date of the row: MM/DD/YYYY (PublishedPrices' format, e.g. "11/25/2025 12:03 AM"),
+            // else ISO YYYY-MM-DD. A date inside any cell is also in the row text, so the
+            // row text is scanned once per format and the cells need no scan of their own.
+            const rowText = row.textContent || '';
+            const dateMatch = rowText.match(/(\\d{1,2}\\/\\d{1,2}\\/\\d{4})/) || rowText.match(/(\\d{4}-\\d{2}-\\d{2})/);
+            const dateStr = dateMatch ? dateMatch[1] : null;
+
+            links.push({
+                href: href,
+                date: dateStr,
+                filename: href.split('/').pop() || href
+            });
+        });
+
+        return links;
+    }
+"""
+
+
 def _normalize_dl_link(base_url: str, href: str) -> Optional[str]:
     """Normalize download link, drop anchors, make absolute, filter non-files."""
     if not href:
@@ -25,20 +101,16 @@ def _normalize_dl_link(base_url: str, href: str) -> Optional[str]:
     if href.startswith("#") or href.startswith("file#"):
         return None
     
-    # Make absolute
-    abs_url = urljoin(base_url, href)
+    # Make absolute, remove fragment
+    abs_url = urljoin(base_url, href).partition("#")[0]
     
-    # Only keep actual file candidates
-    p = urlparse(abs_url)
-    if not p.scheme.startswith("http"):
+    # Must contain .zip or .gz somewhere in the URL (cheapest test first: .xml rows stop here)
+    low = abs_url.lower()
+    if ".zip" not in low and ".gz" not in low:
         return None
     
-    # Remove fragment
-    abs_url = abs_url.split("#")[0]
-    
-    # Must contain .zip or .gz somewhere in the URL
-    low = abs_url.lower()
-    if not (low.endswith(".zip") or low.endswith(".gz") or ".zip" in low or ".gz" in low):
+    # Only keep actual file candidates
+    if not urlsplit(abs_url).scheme.startswith("http"):
         return None
     
     return abs_url
@@ -53,10 +125,10 @@ async def publishedprices_login(page: Page, username: str, password: str, retail
     
     for attempt in range(max_retries):
         try:
-            # Navigate to login page with longer timeout and network idle wait
+            # Navigate to login page and wait for the login form itself
             try:
                 await page.goto("https://url.publishedprices.co.il/login", wait_until="domcontentloaded", timeout=60000)
-                await page.wait_for_load_state("networkidle", timeout=10000)
+                await page.wait_for_selector(USERNAME_SELECTOR, timeout=10000)
             except Exception as nav_err:
                 if attempt < max_retries - 1:
                     logger.warning("login.nav_failed retailer=%s attempt=%d error=%s retrying", retailer_id, attempt + 1, str(nav_err))
@@ -65,59 +137,33 @@ async def publishedprices_login(page: Page, username: str, password: str, retail
                 else:
                     raise
             
-            # Small wait for form to render
-            await page.wait_for_timeout(1000)
-            
-            # Try username selectors
-            username_filled = False
-            username_selectors = ["input[name='username']", "#username", "input[name='Email']", "input[type='email']"]
-            for sel in username_selectors:
-                try:
-                    if await page.locator(sel).count() > 0:
-                        await page.fill(sel, username)
-                        username_filled = True
-                        logger.debug("login.username_filled retailer=%s selector=%s", retailer_id, sel)
-                        break
-                except Exception:
-                    continue
+            # Locate username, password and submit controls by priority in one evaluate
+            found = await page.evaluate(_LOGIN_FIELDS_JS, {
+                "username": USERNAME_CANDIDATES,
+                "password": PASSWORD_CANDIDATES,
+                "submit": SUBMIT_CANDIDATES,
+            })
             
-            if not username_filled:
+            # Fill username
+            if "username" not in found:
                 raise Exception("username_field_not_found")
+            await page.locator(LOGIN_FIELD_SELECTOR % "username").fill(username)
+            logger.debug("login.username_filled retailer=%s selector=%s", retailer_id, found["username"])
             
-            # Try password selectors
-            password_filled = False
-            password_selectors = ["input[name='password']", "#password", "input[type='password']"]
-            for sel in password_selectors:
-                try:
-                    if await page.locator(sel).count() > 0:
-                        await page.fill(sel, password or "")
-                        password_filled = True
-                        logger.debug("login.password_filled retailer=%s selector=%s", retailer_id, sel)
-                        break
-                except Exception:
-                    continue
-            
-            if not password_filled:
+            # Fill password
+            if "password" in found:
+                await page.locator(LOGIN_FIELD_SELECTOR % "password").fill(password or "")
+                logger.debug("login.password_filled retailer=%s", retailer_id)
+            else:
                 logger.warning("login.password_field_not_found retailer=%s continuing_anyway", retailer_id)
             
-            # Try submit selectors
+            # Click submit
             submit_clicked = False
-            submit_selectors = [
-                "button[type='submit']",
-                "input[type='submit']",
-                "button:has-text('כניסה')",
-                "button:has-text('Login')",
-                "form button",  # Fallback: any button in form
-            ]
-            for sel in submit_selectors:
-                try:
-                    if await page.locator(sel).count() > 0:
-                        await page.click(sel)
-                        submit_clicked = True
-                        logger.debug("login.submit_clicked retailer=%s selector=%s", retailer_id, sel)
-                        break
-                except Exception:
-                    continue
+            if "submit" in found:
+                with contextlib.suppress(Exception):
+                    await page.locator(LOGIN_FIELD_SELECTOR % "submit").click()
+                    submit_clicked = True
+                    logger.debug("login.submit_clicked retailer=%s selector=%s", retailer_id, found["submit"])
             
             if not submit_clicked:
                 raise Exception("submit_button_not_found")
@@ -156,15 +202,14 @@ async def publishedprices_navigate_to_folder(page: Page, folder: str, retailer_i
     try:
         # Wait for file/folder tree to render
         await page.wait_for_selector("table, div#filemanager, div.dataTables_wrapper", timeout=15000)
-        await page.wait_for_load_state("networkidle", timeout=10000)
         
         # First try direct navigation
         target_url = f"https://url.publishedprices.co.il/file/cdup/{folder.strip('/')}/"
         try:
             await page.goto(target_url, wait_until="domcontentloaded", timeout=30000)
-            await page.wait_for_timeout(1000)
             
-            # Check if we have files listed (don't filter by date for folder check)
+            # Check if we have files listed (don't filter by date for folder check);
+            # publishedprices_collect_links waits for the file rows itself
             links = await publishedprices_collect_links(page, retailer_id=retailer_id, filter_today=False)
             if links:
                 logger.info("folder.navigate retailer=%s adapter=publishedprices folder=%s ok=true method=direct", retailer_id, folder)
@@ -175,7 +220,10 @@ async def publishedprices_navigate_to_folder(page: Page, folder: str, retailer_i
         # Fallback: go to /file and click the folder
         await page.goto("https://url.publishedprices.co.il/file", wait_until="domcontentloaded", timeout=30000)
         await page.wait_for_selector("table, div#filemanager, div.dataTables_wrapper", timeout=15000)
-        await page.wait_for_load_state("networkidle", timeout=10000)
+        # The listing fills in after the container renders; wait for the folder itself
+        # rather than network idle (the file manager keeps polling)
+        with contextlib.suppress(Exception):
+            await page.wait_for_selector(f"a:has-text('{folder}')", timeout=10000)
         
         # Try clicking folder by name with retries
         for attempt in range(2):
@@ -192,9 +240,9 @@ async def publishedprices_navigate_to_folder(page: Page, folder: str, retailer_i
                     if await page.locator(sel).count():
                         await page.click(sel)
                         await page.wait_for_timeout(1500)
-                        await page.wait_for_load_state("networkidle", timeout=10000)
                         
-                        # Verify we're in the folder by checking for files (don't filter by date for folder check)
+                        # Verify we're in the folder by checking for files (don't filter by date for folder check);
+                        # publishedprices_collect_links waits for the file rows itself
                         links = await publishedprices_collect_links(page, retailer_id=retailer_id, filter_today=False)
                         if links:
                             logger.info("folder.navigate retailer=%s adapter=publishedprices folder=%s ok=true method=click attempt=%d", retailer_id, folder, attempt + 1)
@@ -223,8 +271,15 @@ async def publishedprices_collect_links(page: Page, patterns: Optional[List[str]
     
     # Wait for page to load
     await page.wait_for_load_state("domcontentloaded")
-    await page.wait_for_load_state("networkidle")
-    await page.wait_for_timeout(1000)  # Wait for table to render
+    # A file link means the listing is in; the empty-table row can also be DataTables'
+    # "loading" placeholder, so that (or a timeout) still gets the fixed render time
+    try:
+        first = await page.wait_for_selector(FILE_ROWS_SELECTOR, timeout=15000)
+        rendered = await first.evaluate("el => !el.classList.contains('dataTables_empty')")
+    except Exception:
+        rendered = False
+    if not rendered:
+        await page.wait_for_timeout(1000)  # Wait for table to render
     
     # PublishedPrices uses MM/DD/YYYY format (US format) like "11/25/2025 12:03 AM"
     today_str = datetime.now().strftime("%m/%d/%Y")  # MM/DD/YYYY format
@@ -232,65 +287,7 @@ async def publishedprices_collect_links(page: Page, patterns: Optional[List[str]
     
     # Extract links WITH dates from table rows
     # The file manager shows files in a table with date columns in MM/DD/YYYY HH:MM AM/PM format
-    link_data = await page.evaluate("""
-        () => {
-            const links = [];
-            // Find all table rows
-            const rows = Array.from(document.querySelectorAll('table tr, tbody tr'));
-            
-            rows.forEach((row) => {
-                // Find download link in this row
-                const link = row.querySelector('a[href*=".gz"], a[href*=".zip"], a[href*=".xml"]');
-                if (!link) return;
-                
-                const href = link.getAttribute('href');
-                if (!href) return;
-                
-                // Try to find date in this row
-                // PublishedPrices uses MM/DD/YYYY HH:MM AM/PM format (e.g., "11/25/2025 12:03 AM")
-                const rowText = row.textContent || '';
-                
-                // Try MM/DD/YYYY format (US format used by PublishedPrices)
-                const dateMatch1 = rowText.match(/(\\d{1,2}\\/\\d{1,2}\\/\\d{4})/);
-                // Try YYYY-MM-DD format (ISO format, fallback)
-                const dateMatch2 = rowText.match(/(\\d{4}-\\d{2}-\\d{2})/);
-                // Try DD/MM/YYYY format (European format, fallback)
-                const dateMatch3 = rowText.match(/(\\d{1,2}\\/\\d{1,2}\\/\\d{4})/);
-                
-                let dateStr = null;
-                if (dateMatch1) {
-                    // MM/DD/YYYY format (most likely for PublishedPrices)
-                    dateStr = dateMatch1[1];
-                } else if (dateMatch2) {
-                    dateStr = dateMatch2[1];
-                } else if (dateMatch3) {
-                    dateStr = dateMatch3[1];
-                } else {
-                    // Try to find date in specific cells (especially Date column)
-                    const cells = row.querySelectorAll('td');
-                    cells.forEach(cell => {
-                        const cellText = cell.textContent || '';
-                        // Prioritize MM/DD/YYYY format
-                        const cellDateMatch1 = cellText.match(/(\\d{1,2}\\/\\d{1,2}\\/\\d{4})/);
-                        const cellDateMatch2 = cellText.match(/(\\d{4}-\\d{2}-\\d{2})/);
-                        if (cellDateMatch1 && !dateStr) {
-                            dateStr = cellDateMatch1[1];
-                        } else if (cellDateMatch2 && !dateStr) {
-                            dateStr = cellDateMatch2[1];
-                        }
-                    });
-                }
-                
-                links.push({
-                    href: href,
-                    date: dateStr,
-                    filename: href.split('/').pop() || href
-                });
-            });
-            
-            return links;
-        }
-    """)
+    link_data = await page.evaluate(_FILE_ROWS_JS)
     
     # Normalize to absolute URLs and filter by date
     base_url = page.url
@@ -421,45 +418,7 @@ async def crawl_publishedprices(page: Page, retailer: dict, creds: dict, run_id:
         seen_hashes: Set[str] = set()
         seen_names: Set[str] = set()
         
-        for link in links:
-            filename = link.split('/')[-1] or link  # Fallback for error logging
-            try:
-                # Download file
-                data, resp, filename = await fetch_url(page, link)
-                if data is None:
-                    continue
-                kind = sniff_kind(data)
-                md5_hash = md5_hex(data)
-                
-                # Check for duplicates
-                if md5_hash in seen_hashes:
-                    result.skipped_dupes += 1
-                    continue
-                
-                # Normalize filename for name-based dedupe
-                normalized_name = f"{retailer_id}/{filename.lower()}"
-                if normalized_name in seen_names:
-                    result.skipped_dupes += 1
-                    continue
-                
-                # Add to seen sets
-                seen_hashes.add(md5_hash)
-                seen_names.add(normalized_name)
-                
-                # Unified parse (logs file.downloaded, extracts, parses, logs file.processed)
-                await parse_from_blob(data, filename, retailer_id, run_id)
-                
-                # Update counters based on sniffed kind (not filename extension)
-                if kind == "zip":
-                    result.zips += 1
-                elif kind == "gz":
-                    result.gz += 1
-                result.files_downloaded += 1
-                
-            except Exception as e:
-                result.errors.append(f"download_error:{link}:{e}")
-                logger.error("download.failed retailer=%s link=%s file=%s err=%s", retailer_id, link, filename, str(e))
-                continue
+        await download_links(page, links, retailer_id, seen_hashes, seen_names, run_id, result)
         
     except Exception as e:
         result.errors.append(f"fatal:{e}")
@@ -1,7 +1,13 @@
 from __future__ import annotations
 
-import io, gzip, zipfile, hashlib, datetime as dt
-from typing import Iterable, Tuple
+import io, zipfile, hashlib, datetime as dt
+from typing import BinaryIO, Iterable, Tuple
+
+try:
+    # ISA-L's SIMD inflate is several times faster than zlib on big price feeds
+    from isal.igzip import GzipFile
+except ImportError:
+    from gzip import GzipFile
 
 GZIP_MAGIC = b"\x1f\x8b"
 ZIP_MAGIC  = b"PK"
@@ -24,7 +30,7 @@ def iter_xml_entries(data: bytes, filename_hint: str = "") -> Iterable[Tuple[str
     k = sniff_kind(data)
     if k == "gz":
         try:
-            with gzip.GzipFile(fileobj=io.BytesIO(data)) as gz:
+            with GzipFile(fileobj=io.BytesIO(data)) as gz:
                 xml_bytes = gz.read()
             yield filename_hint.replace(".gz", "").replace(".zip", "") or "data.xml", xml_bytes
             return
@@ -46,6 +52,41 @@ def iter_xml_entries(data: bytes, filename_hint: str = "") -> Iterable[Tuple[str
         yield filename_hint or "data.xml", data
 
 
+def iter_xml_streams(data: bytes, filename_hint: str = "") -> Iterable[Tuple[str, BinaryIO]]:
+    """
+    Yield (inner_name, stream) for XML(s) contained in raw/gz/zip without
+    materializing the decompressed XML: each stream inflates on read.
+    A stream is only valid until the next entry is requested.
+    """
+    k = sniff_kind(data)
+    if k == "gz":
+        gz = GzipFile(fileobj=io.BytesIO(data))
+        try:
+            gz.peek(1)  # validate the header before handing the stream out
+        except Exception:
+            # bad label/corrupt; try zip next
+            gz = None
+        if gz is not None:
+            with gz:
+                yield filename_hint.replace(".gz", "").replace(".zip", "") or "data.xml", gz
+            return
+    if k == "zip" or data.startswith(ZIP_MAGIC):
+        try:
+            zf = zipfile.ZipFile(io.BytesIO(data))
+        except Exception:
+            zf = None
+        if zf is not None:
+            with zf:
+                for name in zf.namelist():
+                    if name.lower().endswith(".xml"):
+                        with zf.open(name) as f:
+                            yield name, f
+            return
+    # raw best effort
+    if b"<" in data[:200] and b">" in data[:200]:
+        yield filename_hint or "data.xml", io.BytesIO(data)
+
+
 def md5_hex(b: bytes) -> str:
     return hashlib.md5(b).hexdigest()
 
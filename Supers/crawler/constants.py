@@ -4,7 +4,24 @@ import os
 LOCAL_DOWNLOAD_DIR = os.getenv("LOCAL_DOWNLOAD_DIR", "downloads")
 LOCAL_JSON_DIR = os.getenv("LOCAL_JSON_DIR", "json_out")
 SCREENSHOTS_DIR = os.getenv("SCREENSHOTS_DIR", "screenshots")
+# Debug screenshots are slow (render + encode on the browser main thread); opt in with DEBUG_SCREENSHOTS=1
+DEBUG_SCREENSHOTS = os.getenv("DEBUG_SCREENSHOTS", "0") == "1"
+# Cheaper per-call stack capture inside Playwright (patches its private modules); opt in with PW_FAST_STACK=1
+PW_FAST_STACK = os.getenv("PW_FAST_STACK", "0") == "1"
+# Worker processes for XML parsing (0 = parse inline on the event loop thread). Kept small:
+# each task ships a whole blob to its worker and every parsed row back, so more workers
+# mostly multiply peak memory across the concurrently crawled retailers and files
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+# Files of one retailer downloaded (and parsed) concurrently; each holds its whole blob in memory
+DOWNLOAD_CONCURRENCY = max(1, int(os.getenv("DOWNLOAD_CONCURRENCY", "4")))
 MAX_LOGIN_RETRIES = int(os.getenv("MAX_RETRIES_LOGIN", "3"))
+# asyncpg pool: connections kept open / allowed, and prepared statements cached per connection
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "10"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "50"))
+DB_STMT_CACHE = int(os.getenv("DB_STMT_CACHE", "1024"))
+# Connections one price batch saves on concurrently; small, so retailers crawled in
+# parallel (and their store/retailer upserts) always find free connections in the pool
+DB_SAVE_PARALLELISM = max(1, int(os.getenv("DB_SAVE_PARALLELISM", "4")))
 
 PUBLISHED_HOST = "url.publishedprices.co.il"
 DEFAULT_DOWNLOAD_SUFFIXES = (".xml", ".gz", ".zip")
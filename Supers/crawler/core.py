@@ -1,24 +1,36 @@
 # crawler/core.py
 from __future__ import annotations
 import asyncio
+import contextlib
 import gc
 from datetime import datetime, timezone
 import uuid
-from typing import List, Set
+from typing import List, Optional, Set
 
-from playwright.async_api import async_playwright
+from playwright.async_api import Browser, async_playwright
 
 from . import logger
 from .constants import PUBLISHED_HOST
-from .credentials import CREDS
+from .credentials import CREDS, resolve_creds_key
+from .db import clear_id_caches
 from .models import RetailerResult
-from .playwright_helpers import new_context
+from .playwright_helpers import context_page, launch_browser
 from .adapters import crawl_publishedprices, bina_adapter, generic_adapter, wolt_dateindex_adapter
 from .memory_utils import log_memory
+from .parsers import shutdown_parse_pool
 
+# run_all calls in progress (the Flask app can overlap them on its shared loop); the
+# parser workers are stopped when the last one finishes
+_active_runs = 0
 
-async def crawl_retailer(retailer: dict, run_id: str) -> List[dict]:
-    """Crawl a single retailer with all its sources"""
+
+async def crawl_retailer(retailer: dict, run_id: str, browser: Optional[Browser] = None) -> List[dict]:
+    """
+    Crawl a single retailer with all its sources.
+    
+    Runs in its own context on `browser` (shared across the run by run_all);
+    launches a private browser when none is given.
+    """
     retailer_id = retailer.get("id", "unknown")
     retailer_name = retailer.get("name", "Unknown")
     
@@ -43,9 +55,15 @@ async def crawl_retailer(retailer: dict, run_id: str) -> List[dict]:
     
     results = []
 
-    async with async_playwright() as pw:
-        browser, ctx = await new_context(pw)
-        page = await ctx.new_page()
+    if browser is None:
+        async with async_playwright() as pw:
+            browser = await launch_browser(pw)
+            try:
+                return await crawl_retailer(retailer, run_id, browser)
+            finally:
+                await browser.close()
+
+    async with context_page(browser) as page:
 
         try:
             for source in sources:
@@ -81,32 +99,22 @@ async def crawl_retailer(retailer: dict, run_id: str) -> List[dict]:
                             reasons=["credentials_missing"]
                         )
                     else:
-                        # Case-insensitive credential lookup
-                        if creds_key not in CREDS:
-                            # Try case-insensitive match
-                            creds_key_lower = creds_key.lower()
-                            matched_key = None
-                            for key in CREDS.keys():
-                                if key.lower() == creds_key_lower:
-                                    matched_key = key
-                                    break
-                            if matched_key:
-                                creds_key = matched_key
-                                logger.debug(f"credentials.case_match retailer={retailer_id} original={source.get('creds_key') or retailer.get('tenantKey')} matched={creds_key}")
-                            else:
-                                error_msg = f"no_credentials_mapped for key '{creds_key}'"
-                                logger.error(f"credentials.missing retailer={retailer_id} creds_key={creds_key}")
-                                result = RetailerResult(
-                                    retailer_id=retailer_id,
-                                    source_url=source_url,
-                                    errors=[error_msg],
-                                    adapter="publishedprices",
-                                    reasons=["credentials_missing"]
-                                )
-                        
-                        # If we have a valid creds_key (either original or matched), proceed
-                        if creds_key in CREDS:
-                            credentials = CREDS[creds_key]
+                        # Case/whitespace-insensitive credential lookup
+                        matched_key = resolve_creds_key(creds_key)
+                        if matched_key is None:
+                            error_msg = f"no_credentials_mapped for key '{creds_key}'"
+                            logger.error(f"credentials.missing retailer={retailer_id} creds_key={creds_key}")
+                            result = RetailerResult(
+                                retailer_id=retailer_id,
+                                source_url=source_url,
+                                errors=[error_msg],
+                                adapter="publishedprices",
+                                reasons=["credentials_missing"]
+                            )
+                        else:
+                            if matched_key != creds_key:
+                                logger.debug(f"credentials.case_match retailer={retailer_id} original={creds_key} matched={matched_key}")
+                            credentials = CREDS[matched_key]
                             result = await crawl_publishedprices(page, retailer, credentials, run_id)
                 elif adapter_type == "bina":
                     result = await bina_adapter(page, source, retailer_id, seen_hashes, seen_names, run_id)
@@ -130,10 +138,8 @@ async def crawl_retailer(retailer: dict, run_id: str) -> List[dict]:
                     logger.info("source.skipped retailer=%s url=%s reason=no_downloads", retailer_id, source_url)
                 
         finally:
-            await ctx.close()
-            await browser.close()
-            # Explicit cleanup to free memory
-            del page, ctx, browser
+            # Explicit cleanup to free memory (the context itself is closed by context_page)
+            del page
             gc.collect()
 
     return results
@@ -145,8 +151,10 @@ async def run_all(retailers: List[dict]) -> List[dict]:
     
     Uses a semaphore to limit concurrent crawlers to 3 at a time,
     preventing memory exhaustion from running too many Playwright
-    browsers simultaneously.
+    contexts simultaneously. One Chromium is launched for the whole run;
+    each retailer gets its own context.
     """
+    global _active_runs
     # Generate run ID for this execution
     run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + "-" + str(uuid.uuid4())[:8]
     started_at = datetime.now(timezone.utc).isoformat()
@@ -157,25 +165,60 @@ async def run_all(retailers: List[dict]) -> List[dict]:
     # Semaphore to limit concurrent crawlers (prevents OOM from too many browsers)
     sem = asyncio.Semaphore(3)
     
+    # Started inside the try below, so whatever did start is stopped again
+    pw = None
+    browser: Optional[Browser] = None
+    browser_lock = asyncio.Lock()
+    
+    async def live_browser() -> Browser:
+        # Relaunch if Chromium crashed mid-run so the remaining retailers still get a browser
+        nonlocal browser
+        async with browser_lock:
+            if not browser.is_connected():
+                logger.warning("browser.disconnected relaunching=true")
+                # Release the dead browser's driver-side state before replacing it
+                with contextlib.suppress(Exception):
+                    await browser.close()
+                browser = await launch_browser(pw)
+            return browser
+    
     async def limited_crawl(retailer: dict):
         slug = retailer.get("id", retailer.get("name", "unknown"))
         async with sem:
             logger.debug("retailer.start id=%s acquiring_semaphore", slug)
             log_memory(logger, f"before_retailer id={slug}")
             try:
-                result = await crawl_retailer(retailer, run_id)
+                result = await crawl_retailer(retailer, run_id, await live_browser())
                 return result
             finally:
                 gc.collect()
                 log_memory(logger, f"after_retailer id={slug}")
                 logger.debug("retailer.done id=%s releasing_semaphore", slug)
     
-    tasks = []
-    for retailer in retailers:
-        if retailer.get("enabled", True):
-            tasks.append(limited_crawl(retailer))
-    
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # Ids cached by an earlier run may belong to rows deleted since; each run starts fresh
+    clear_id_caches()
+    _active_runs += 1
+    try:
+        pw = await async_playwright().start()
+        browser = await launch_browser(pw)
+        
+        tasks = []
+        for retailer in retailers:
+            if retailer.get("enabled", True):
+                tasks.append(limited_crawl(retailer))
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        _active_runs -= 1
+        if browser is not None:
+            # A crashed browser may fail to close; Playwright must still be stopped
+            with contextlib.suppress(Exception):
+                await browser.close()
+        if pw is not None:
+            await pw.stop()
+        if not _active_runs:
+            # Spawned parser workers must not outlive the run (or the request that started it)
+            await shutdown_parse_pool()
 
     log_memory(logger, "run_all.done_before_manifest")
 
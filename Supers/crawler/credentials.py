@@ -2,7 +2,7 @@
 from __future__ import annotations
 import json
 import os
-from typing import Dict
+from typing import Dict, Optional
 
 from .config import load_retailers_config
 
@@ -43,3 +43,21 @@ def load_publishedprices_creds() -> Dict[str, dict]:
 # Global credentials map used by adapters
 CREDS = load_publishedprices_creds()
 
+
+
+def _normalize_key(key: str) -> str:
+    """Case- and whitespace-insensitive form of a tenant key (e.g. 'RamiLevi ' == 'ramilevi')."""
+    return " ".join(key.split()).casefold()
+
+
+# Normalized key -> actual CREDS key, built once so lookups are O(1)
+_CREDS_KEYS: Dict[str, str] = {_normalize_key(k): k for k in CREDS}
+
+
+def resolve_creds_key(key: Optional[str]) -> Optional[str]:
+    """Return the CREDS key matching `key` (exact first, then normalized), or None."""
+    if not key:
+        return None
+    if key in CREDS:
+        return key
+    return _CREDS_KEYS.get(_normalize_key(key))
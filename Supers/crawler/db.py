@@ -1,18 +1,119 @@
 # crawler/db.py
 from __future__ import annotations
+import asyncio
+import functools
 import os
+import re
+import time
 import asyncpg
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterator, Tuple, Union
 from datetime import datetime
 from . import logger
+from .constants import DB_POOL_MIN, DB_POOL_MAX, DB_STMT_CACHE, DB_SAVE_PARALLELISM
 
 _pool: Optional[asyncpg.Pool] = None
+# Serializes pool creation when many tasks hit get_pool() before the pool exists
+_pool_lock = asyncio.Lock()
+
+# Price batches are split into one concurrently saved chunk per this many rows (up to DB_SAVE_PARALLELISM)
+PARALLEL_CHUNK_ROWS = 1000
+# Rows per UNNEST upsert statement, so a huge batch is never bound as one giant set of arrays
+UNNEST_CHUNK_ROWS = 1000
+# Lock conflicts between concurrent saves are transient: the failed unit is retried this often
+DB_RETRIES = 3
+_RETRYABLE_ERRORS = (asyncpg.DeadlockDetectedError, asyncpg.SerializationError)
+
+async def _retrying(op, what: str):
+    """Await op(), re-running it (with a short backoff) on deadlock/serialization failures."""
+    for attempt in range(1, DB_RETRIES + 1):
+        try:
+            return await op()
+        except _RETRYABLE_ERRORS as e:
+            if attempt == DB_RETRIES:
+                raise
+            logger.warning("db.retry op=%s attempt=%d error=%s", what, attempt, e)
+            await asyncio.sleep(0.05 * 2 ** attempt)
+
+# Retailer and store ids barely change between batches, so a recent upsert of the same
+# (slug, name) / store row is remembered and the next batch of the run skips it
+ID_CACHE_TTL = 3600
+STORE_CACHE_MAX = 10000
+_retailer_ids: Dict[Tuple[str, str], Tuple[int, float]] = {}
+# retailer db id -> {(externalId, name, city, address): (store db id, cached at)}
+_store_ids: Dict[int, Dict[tuple, Tuple[int, float]]] = {}
+
+def clear_id_caches() -> None:
+    """Forget all cached retailer/store ids, so a new run never reuses ids of rows deleted since."""
+    _retailer_ids.clear()
+    _store_ids.clear()
+
+def _cached_id(cache: Dict, key) -> Optional[int]:
+    """Return the id cached under key if it is younger than ID_CACHE_TTL."""
+    hit = cache.get(key)
+    if hit and time.monotonic() - hit[1] < ID_CACHE_TTL:
+        return hit[0]
+    return None
+
+def _remember_retailer(slug: str, name: str, retailer_db_id: int, cached_at: float) -> None:
+    """Cache a committed retailer upsert; entries for other names of the slug are now stale."""
+    for key in [key for key in _retailer_ids if key[0] == slug]:
+        del _retailer_ids[key]
+    _retailer_ids[(slug, name)] = (retailer_db_id, cached_at)
+
+# Plain decimal prices; anything else (empty, "N/A", "nan", ...) is rejected without raising
+_PRICE_RE = re.compile(r"\s*-?(?:\d+\.?\d*|\.\d+)\s*")
+
+def _parse_price(value) -> Optional[float]:
+    """Parse a feed price, or None if it is not a number."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and _PRICE_RE.fullmatch(value):
+        return float(value)
+    return None
+
+# Non-ISO date layouts seen in retailer feeds; ISO ones go through datetime.fromisoformat
+_DATE_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%d-%m-%Y %H:%M:%S", "%d-%m-%Y")
+
+def _parse_timestamp(value: str, formats: List[str]) -> Optional[datetime]:
+    """
+    Parse a feed date (first 19 chars, no tz). Returns None if no known format matches.
+    
+    `formats` is the caller's per-batch copy of _DATE_FORMATS; the format that matched
+    is moved to its front, since a feed keeps one layout throughout.
+    """
+    value = value[:19]
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for i, fmt in enumerate(formats):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if i:
+            formats.insert(0, formats.pop(i))
+        return parsed
+    return None
 
 async def get_pool() -> Optional[asyncpg.Pool]:
     global _pool
     if _pool: return _pool
     if not os.getenv("DATABASE_URL"): return None
-    _pool = await asyncpg.create_pool(os.getenv("DATABASE_URL"), min_size=1, max_size=5)
+    async with _pool_lock:
+        if _pool: return _pool
+        _pool = await asyncpg.create_pool(
+            os.getenv("DATABASE_URL"),
+            min_size=min(DB_POOL_MIN, DB_POOL_MAX),
+            max_size=DB_POOL_MAX,
+            statement_cache_size=DB_STMT_CACHE,
+            # The statement set is small and fixed: 0 keeps cached statements for the
+            # connection's life instead of re-preparing them every 300s (asyncpg's default)
+            max_cached_statement_lifetime=0,
+            max_inactive_connection_lifetime=300,
+            # Short upserts never benefit from JIT compilation, but can pay for it in planning
+            server_settings={"jit": "off"},
+        )
     return _pool
 
 async def close_pool():
@@ -28,29 +129,63 @@ async def upsert_retailer(retailer_id: str, name: str, need_creds: Optional[bool
     """
     pool = await get_pool()
     if not pool: return None
-    async with pool.acquire() as conn:
-        if need_creds is None:
-            # Don't update needCreds - preserve existing value
-            row = await conn.fetchrow("""
-                INSERT INTO retailers (slug, name, "needCreds", "createdAt", "updatedAt")
-                VALUES ($1, $2, false, NOW(), NOW())
-                ON CONFLICT (slug) DO UPDATE SET 
-                    name = EXCLUDED.name,
-                    "updatedAt" = NOW()
-                RETURNING id
-            """, retailer_id, name)
-        else:
-            # Update needCreds explicitly
-            row = await conn.fetchrow("""
-                INSERT INTO retailers (slug, name, "needCreds", "createdAt", "updatedAt")
-                VALUES ($1, $2, $3, NOW(), NOW())
-                ON CONFLICT (slug) DO UPDATE SET 
-                    name = EXCLUDED.name,
-                    "needCreds" = EXCLUDED."needCreds",
-                    "updatedAt" = NOW()
-                RETURNING id
-            """, retailer_id, name, need_creds)
-        return row['id'] if row else None
+    # Single statement: the pool acquires and releases a connection around it
+    db_retailer_id = await _upsert_retailer(pool, retailer_id, name, need_creds)
+    if db_retailer_id:
+        _remember_retailer(retailer_id, name, db_retailer_id, time.monotonic())
+    return db_retailer_id
+
+UPSERT_RETAILER_SQL = """
+    WITH ins AS (
+        INSERT INTO retailers (slug, name, "needCreds", "createdAt", "updatedAt")
+        VALUES ($1, $2, false, NOW(), NOW())
+        ON CONFLICT (slug) DO UPDATE SET 
+            name = EXCLUDED.name,
+            "updatedAt" = NOW()
+        WHERE retailers.name IS DISTINCT FROM EXCLUDED.name
+        RETURNING id
+    )
+    SELECT id FROM ins
+    UNION ALL
+    SELECT id FROM retailers WHERE slug = $1 AND NOT EXISTS (SELECT 1 FROM ins)
+"""
+UPSERT_RETAILER_CREDS_SQL = """
+    WITH ins AS (
+        INSERT INTO retailers (slug, name, "needCreds", "createdAt", "updatedAt")
+        VALUES ($1, $2, $3, NOW(), NOW())
+        ON CONFLICT (slug) DO UPDATE SET 
+            name = EXCLUDED.name,
+            "needCreds" = EXCLUDED."needCreds",
+            "updatedAt" = NOW()
+        WHERE (retailers.name, retailers."needCreds")
+              IS DISTINCT FROM (EXCLUDED.name, EXCLUDED."needCreds")
+        RETURNING id
+    )
+    SELECT id FROM ins
+    UNION ALL
+    SELECT id FROM retailers WHERE slug = $1 AND NOT EXISTS (SELECT 1 FROM ins)
+"""
+SELECT_RETAILER_ID_SQL = "SELECT id FROM retailers WHERE slug = $1"
+
+async def _upsert_retailer(conn: Union[asyncpg.Connection, asyncpg.Pool], retailer_id: str, name: str,
+                           need_creds: Optional[bool] = None) -> Optional[int]:
+    """
+    upsert_retailer on a connection the caller already holds (or straight on the pool).
+    
+    Unchanged rows are not rewritten (no new row version); their id comes from the
+    fallback SELECT, since RETURNING skips rows the WHERE filtered out.
+    """
+    if need_creds is None:
+        # Don't update needCreds - preserve existing value
+        row = await conn.fetchrow(UPSERT_RETAILER_SQL, retailer_id, name)
+    else:
+        # Update needCreds explicitly
+        row = await conn.fetchrow(UPSERT_RETAILER_CREDS_SQL, retailer_id, name, need_creds)
+    if row is None:
+        # The row was inserted by a concurrent transaction after this statement's snapshot:
+        # the conflict skipped it, but the fallback SELECT could not see it. A new statement can.
+        row = await conn.fetchrow(SELECT_RETAILER_ID_SQL, retailer_id)
+    return row['id'] if row else None
 
 async def fetch_retailer_slugs(need_creds: Optional[bool] = None) -> List[str]:
     """Fetch retailer slugs from database, optionally filtered by needCreds"""
@@ -58,22 +193,22 @@ async def fetch_retailer_slugs(need_creds: Optional[bool] = None) -> List[str]:
     if not pool: return []
     
     try:
-        async with pool.acquire() as conn:
-            if need_creds is None:
-                # Fetch all enabled retailers
-                rows = await conn.fetch("""
-                    SELECT slug FROM retailers 
-                    WHERE "isActive" = true
-                    ORDER BY slug
-                """)
-            else:
-                # Filter by needCreds
-                rows = await conn.fetch("""
-                    SELECT slug FROM retailers 
-                    WHERE "isActive" = true AND "needCreds" = $1
-                    ORDER BY slug
-                """, need_creds)
-            return [row['slug'] for row in rows]
+        # Single statements: the pool acquires and releases a connection around each
+        if need_creds is None:
+            # Fetch all enabled retailers
+            rows = await pool.fetch("""
+                SELECT slug FROM retailers 
+                WHERE "isActive" = true
+                ORDER BY slug
+            """)
+        else:
+            # Filter by needCreds
+            rows = await pool.fetch("""
+                SELECT slug FROM retailers 
+                WHERE "isActive" = true AND "needCreds" = $1
+                ORDER BY slug
+            """, need_creds)
+        return [row['slug'] for row in rows]
     except Exception as e:
         logger.error(f"db.fetch_retailer_slugs.failed error={e}")
         return []
@@ -83,29 +218,50 @@ async def upsert_store(retailer_db_id: int, external_id: str, name: str = None,
     if not external_id: return None
     pool = await get_pool()
     if not pool: return None
-    
+    return await _upsert_store(pool, retailer_db_id, external_id, name, city, address)
+
+UPSERT_STORE_SQL = """
+    WITH ins AS (
+        INSERT INTO stores ("retailerId", "externalId", name, city, address, "createdAt", "updatedAt")
+        VALUES ($1, $2, $3, $4, $5, NOW(), NOW())
+        ON CONFLICT ("retailerId", "externalId") 
+        DO UPDATE SET 
+            name = COALESCE(NULLIF(NULLIF(EXCLUDED.name, ''), 'Store ' || EXCLUDED."externalId"), stores.name),
+            city = COALESCE(NULLIF(EXCLUDED.city, ''), stores.city),
+            address = COALESCE(NULLIF(EXCLUDED.address, ''), stores.address),
+            "updatedAt" = NOW()
+        WHERE (stores.name, stores.city, stores.address) IS DISTINCT FROM (
+            COALESCE(NULLIF(NULLIF(EXCLUDED.name, ''), 'Store ' || EXCLUDED."externalId"), stores.name),
+            COALESCE(NULLIF(EXCLUDED.city, ''), stores.city),
+            COALESCE(NULLIF(EXCLUDED.address, ''), stores.address))
+        RETURNING id
+    )
+    SELECT id FROM ins
+    UNION ALL
+    SELECT id FROM stores WHERE "retailerId" = $1 AND "externalId" = $2 AND NOT EXISTS (SELECT 1 FROM ins)
+"""
+SELECT_STORE_ID_SQL = 'SELECT id FROM stores WHERE "retailerId" = $1 AND "externalId" = $2'
+
+async def _upsert_store(conn: Union[asyncpg.Connection, asyncpg.Pool], retailer_db_id: int, external_id: str, name: str = None,
+                        city: str = None, address: str = None) -> Optional[int]:
+    """upsert_store on a connection the caller already holds (or straight on the pool)."""
+    if not external_id: return None
     display_name = name or f"Store {external_id}"
     
-    # Log when we're trying to update with address/city data
+    # Log when we're trying to update with address/city data (per store, so debug-only)
     if address or city:
-        logger.info(f"upsert_store retailer_id={retailer_db_id} ext_id={external_id} "
-                   f"name={display_name} city={city} address={address}")
+        logger.debug("upsert_store retailer_id=%s ext_id=%s name=%s city=%s address=%s",
+                     retailer_db_id, external_id, display_name, city, address)
     
-    async with pool.acquire() as conn:
-        # Use COALESCE but allow NULL to overwrite if we explicitly want to clear it
-        # However, we'll prefer non-NULL values: if EXCLUDED has a value, use it; otherwise keep existing
-        row = await conn.fetchrow("""
-            INSERT INTO stores ("retailerId", "externalId", name, city, address, "createdAt", "updatedAt")
-            VALUES ($1, $2, $3, $4, $5, NOW(), NOW())
-            ON CONFLICT ("retailerId", "externalId") 
-            DO UPDATE SET 
-                name = COALESCE(NULLIF(EXCLUDED.name, ''), stores.name),
-                city = COALESCE(NULLIF(EXCLUDED.city, ''), stores.city),
-                address = COALESCE(NULLIF(EXCLUDED.address, ''), stores.address),
-                "updatedAt" = NOW()
-            RETURNING id
-        """, retailer_db_id, external_id, display_name, city, address)
-        return row['id'] if row else None
+    # Use COALESCE but allow NULL to overwrite if we explicitly want to clear it
+    # However, we'll prefer non-NULL values: if EXCLUDED has a value, use it; otherwise keep existing
+    # The "Store <id>" placeholder only names new stores, it never replaces a real name
+    # Unchanged stores are left alone and their id is read back by the fallback SELECT
+    row = await conn.fetchrow(UPSERT_STORE_SQL, retailer_db_id, external_id, display_name, city, address)
+    if row is None:
+        # Inserted concurrently after this statement's snapshot (see _upsert_retailer)
+        row = await conn.fetchrow(SELECT_STORE_ID_SQL, retailer_db_id, external_id)
+    return row['id'] if row else None
 
 async def upsert_product(barcode: str, name: str = None, brand: str = None, 
                          quantity: float = None, unit: str = None,
@@ -113,23 +269,38 @@ async def upsert_product(barcode: str, name: str = None, brand: str = None,
     pool = await get_pool()
     if not pool: return None
     
-    placeholder_name = name or f"Unknown ({barcode})"
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            INSERT INTO products (barcode, name, brand, quantity, unit, "isWeighted", "imageUrl", "createdAt", "updatedAt")
-            VALUES ($1, $2, $3, $4, $5, $6, $7, NOW(), NOW())
-            ON CONFLICT (barcode) 
-            DO UPDATE SET 
-                name = COALESCE(NULLIF(EXCLUDED.name, ''), products.name),
-                brand = COALESCE(NULLIF(EXCLUDED.brand, ''), products.brand),
-                quantity = COALESCE(EXCLUDED.quantity, products.quantity),
-                unit = COALESCE(NULLIF(EXCLUDED.unit, ''), products.unit),
-                "isWeighted" = COALESCE(EXCLUDED."isWeighted", products."isWeighted"),
-                "imageUrl" = COALESCE(NULLIF(EXCLUDED."imageUrl", ''), products."imageUrl"),
-                "updatedAt" = NOW()
-            RETURNING id
-        """, barcode, name if name else placeholder_name, brand, quantity, unit, is_weighted, image_url)
-        return row['id'] if row else None
+        async with conn.transaction():
+            ids = await _upsert_products(conn, [(barcode, name, brand, quantity, unit, is_weighted, image_url)])
+    return ids.get(barcode)
+
+EXACT_SNAPSHOT_SQL = """
+    SELECT id FROM price_snapshots
+    WHERE "productId" = $1 
+      AND "retailerId" = $2 
+      AND ("storeId" = $3 OR ("storeId" IS NULL AND $3 IS NULL))
+      AND timestamp = $4
+    LIMIT 1
+"""
+TOUCH_SNAPSHOT_SQL = """
+    UPDATE price_snapshots
+    SET "seenAt" = NOW()
+    WHERE id = $1
+"""
+LATEST_SNAPSHOT_SQL = """
+    SELECT id, price, "isOnSale" FROM price_snapshots
+    WHERE "productId" = $1 
+      AND "retailerId" = $2 
+      AND ("storeId" = $3 OR ("storeId" IS NULL AND $3 IS NULL))
+    ORDER BY timestamp DESC, "seenAt" DESC
+    LIMIT 1
+"""
+INSERT_SNAPSHOT_SQL = """
+    INSERT INTO price_snapshots 
+        ("productId", "retailerId", "storeId", price, "isOnSale", timestamp, "seenAt")
+    VALUES ($1, $2, $3, $4, $5, $6, NOW())
+    RETURNING id
+"""
 
 async def create_price_snapshot(product_id: int, retailer_id: int, price: float,
                                 is_on_sale: bool, timestamp: datetime, store_id: Optional[int]) -> Optional[int]:
@@ -145,34 +316,16 @@ async def create_price_snapshot(product_id: int, retailer_id: int, price: float,
     if not pool: return None
     async with pool.acquire() as conn:
         # Check if snapshot already exists (exact timestamp match)
-        existing = await conn.fetchrow("""
-            SELECT id FROM price_snapshots
-            WHERE "productId" = $1 
-              AND "retailerId" = $2 
-              AND ("storeId" = $3 OR ("storeId" IS NULL AND $3 IS NULL))
-              AND timestamp = $4
-            LIMIT 1
-        """, product_id, retailer_id, store_id, timestamp)
+        existing = await conn.fetchrow(EXACT_SNAPSHOT_SQL, product_id, retailer_id, store_id, timestamp)
         
         if existing:
             # Update seenAt to reflect we've seen this price again
-            await conn.execute("""
-                UPDATE price_snapshots
-                SET "seenAt" = NOW()
-                WHERE id = $1
-            """, existing['id'])
+            await conn.execute(TOUCH_SNAPSHOT_SQL, existing['id'])
             return existing['id']
         
         # DEBOUNCE CHECK: Check if latest snapshot has same price and sale status
         # This prevents spam: if price hasn't changed, don't insert duplicate
-        latest = await conn.fetchrow("""
-            SELECT id, price, "isOnSale" FROM price_snapshots
-            WHERE "productId" = $1 
-              AND "retailerId" = $2 
-              AND ("storeId" = $3 OR ("storeId" IS NULL AND $3 IS NULL))
-            ORDER BY timestamp DESC, "seenAt" DESC
-            LIMIT 1
-        """, product_id, retailer_id, store_id)
+        latest = await conn.fetchrow(LATEST_SNAPSHOT_SQL, product_id, retailer_id, store_id)
         
         if latest:
             latest_price = float(latest['price'])
@@ -181,38 +334,313 @@ async def create_price_snapshot(product_id: int, retailer_id: int, price: float,
             # If price and sale status are identical, skip insertion (debounce)
             if abs(latest_price - price) < 0.01 and latest_is_on_sale == is_on_sale:
                 # Update seenAt on the existing record instead of creating duplicate
-                await conn.execute("""
-                    UPDATE price_snapshots
-                    SET "seenAt" = NOW()
-                    WHERE id = $1
-                """, latest['id'])
+                await conn.execute(TOUCH_SNAPSHOT_SQL, latest['id'])
                 return latest['id']
         
         # Insert new snapshot (price changed or first snapshot)
-        row = await conn.fetchrow("""
-            INSERT INTO price_snapshots 
-                ("productId", "retailerId", "storeId", price, "isOnSale", timestamp, "seenAt")
-            VALUES ($1, $2, $3, $4, $5, $6, NOW())
-            RETURNING id
-        """, product_id, retailer_id, store_id, price, is_on_sale, timestamp)
+        row = await conn.fetchrow(INSERT_SNAPSHOT_SQL, product_id, retailer_id, store_id, price, is_on_sale, timestamp)
         return row['id'] if row else None
 
+def _chunked(items: List[tuple], size: int) -> Iterator[List[tuple]]:
+    """Yield consecutive slices of at most `size` items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _conflict_rounds(items: List[tuple]) -> List[List[tuple]]:
+    """
+    Split tuples into rounds with unique keys (item[0]), preserving order.
+    
+    A single INSERT ... ON CONFLICT DO UPDATE cannot touch the same row twice, so
+    the 2nd occurrence of a key goes to round 2, and so on. Applying the rounds in
+    order gives the same result as upserting the items one by one.
+    """
+    rounds: List[List[tuple]] = []
+    seen: Dict[str, int] = {}
+    for item in items:
+        n = seen.get(item[0], 0)
+        seen[item[0]] = n + 1
+        if n == len(rounds):
+            rounds.append([])
+        rounds[n].append(item)
+    return rounds
+
+# Conflict updates of the optional product columns (args 3..7), each keeping the stored value when empty
+_PRODUCT_UPDATES = (
+    ("brand", "COALESCE(NULLIF(EXCLUDED.brand, ''), products.brand)"),
+    ("quantity", "COALESCE(EXCLUDED.quantity, products.quantity)"),
+    ("unit", "COALESCE(NULLIF(EXCLUDED.unit, ''), products.unit)"),
+    ('"isWeighted"', 'COALESCE(EXCLUDED."isWeighted", products."isWeighted")'),
+    ('"imageUrl"', 'COALESCE(NULLIF(EXCLUDED."imageUrl", \'\'), products."imageUrl")'),
+)
+
+@functools.lru_cache(maxsize=64)
+def _product_upsert_sql(mask: Tuple[bool, ...]) -> str:
+    """
+    UNNEST product upsert whose DO UPDATE only sets the optional columns flagged in `mask`.
+    Cached per mask, so asyncpg's statement cache sees the same text for every batch.
+    """
+    updates = [("name", "COALESCE(NULLIF(EXCLUDED.name, ''), products.name)")]
+    updates += [update for update, present in zip(_PRODUCT_UPDATES, mask) if present]
+    set_clause = ",\n                ".join(f"{col} = {expr}" for col, expr in updates)
+    current = ", ".join(f"products.{col}" for col, _ in updates)
+    new = ", ".join(expr for _, expr in updates)
+    return f"""
+            INSERT INTO products (barcode, name, brand, quantity, unit, "isWeighted", "imageUrl", "createdAt", "updatedAt")
+            SELECT b, n, br, q, u, w, img, NOW(), NOW()
+            FROM UNNEST($1::text[], $2::text[], $3::text[], $4::float8[], $5::text[], $6::bool[], $7::text[])
+                AS t(b, n, br, q, u, w, img)
+            ON CONFLICT (barcode) 
+            DO UPDATE SET 
+                {set_clause},
+                "updatedAt" = NOW()
+            WHERE ({current}) IS DISTINCT FROM ({new})
+            RETURNING barcode, id
+        """
+
+async def upsert_products(products: List[tuple]) -> Dict[str, int]:
+    """
+    Upsert a batch of (barcode, name, brand, quantity, unit, is_weighted, image_url) tuples,
+    in order, with upsert_product semantics. Returns {barcode: product id}.
+    
+    Feeds repeat a barcode once per store, so rows are first merged per barcode (later
+    non-empty values win, like the conflict update). Each column is then sent as one array
+    and expanded with UNNEST, so every UNNEST_CHUNK_ROWS products are a single
+    INSERT ... ON CONFLICT. Rows whose
+    values would not change are skipped by the DO UPDATE's WHERE, so repeat crawls
+    don't rewrite them; their ids are looked up afterwards in one SELECT.
+    """
+    if not products: return {}
+    pool = await get_pool()
+    if not pool: return {}
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            return await _upsert_products(conn, products)
+
+SELECT_PRODUCT_IDS_SQL = "SELECT barcode, id FROM products WHERE barcode = ANY($1::text[])"
+
+async def _upsert_products(conn: asyncpg.Connection, products: List[tuple]) -> Dict[str, int]:
+    """upsert_products on a connection the caller already holds (and wraps in a transaction)."""
+    merged: Dict[str, list] = {}
+    for product in products:
+        current = merged.get(product[0])
+        if current is None:
+            merged[product[0]] = list(product)
+            continue
+        for i in range(1, 7):
+            # None/'' never overwrite, anything else (including is_weighted=False) does
+            if product[i] is not None and product[i] != '':
+                current[i] = product[i]
+    # Sorted by barcode, so concurrent saves sharing products lock their rows in the same
+    # order and cannot deadlock on each other
+    args = sorted(
+        (barcode, name if name else f"Unknown ({barcode})", brand, quantity, unit, is_weighted, image_url)
+        for barcode, name, brand, quantity, unit, is_weighted, image_url in merged.values()
+    )
+    ids: Dict[str, int] = {}
+    for chunk in _chunked(args, UNNEST_CHUNK_ROWS):
+        columns = list(zip(*chunk))
+        # Columns that are empty on every row would only be COALESCEd back to themselves
+        mask = tuple(any(v is not None and v != '' for v in columns[i]) for i in range(2, 7))
+        
+        async def upsert_chunk(sql=_product_upsert_sql(mask), columns=columns):
+            # Savepoint: a chunk that hits a lock conflict is rolled back and retried alone
+            async with conn.transaction():
+                return await conn.fetch(sql, *map(list, columns))
+        
+        rows = await _retrying(upsert_chunk, "upsert_products")
+        ids.update((row['barcode'], row['id']) for row in rows)
+    
+    # Unchanged products are not returned by the upsert
+    missing = list(merged.keys() - ids.keys())
+    if missing:
+        rows = await conn.fetch(SELECT_PRODUCT_IDS_SQL, missing)
+        ids.update((row['barcode'], row['id']) for row in rows)
+    return ids
+
+def _debounce_snapshots(snapshots: List[tuple], exact: List, latest: List):
+    """
+    Apply create_price_snapshot's dedup/debounce rules to a whole batch, in row order.
+    
+    `exact` maps staged rows to an existing snapshot with the same timestamp, `latest`
+    is the newest existing snapshot per (product, store). Rows inserted earlier in the
+    batch count as existing for later rows, exactly as with one-by-one inserts.
+    Returns (snapshot ids to touch, staged ords to insert).
+    """
+    exact_ids = {r["ord"]: r["id"] for r in exact}
+    latest_by_key = {
+        (r["productId"], r["storeId"]): (r["id"], float(r["price"]), bool(r["isOnSale"]), r["timestamp"])
+        for r in latest
+    }
+    pending = set()  # (product, store, timestamp) inserted earlier in this batch
+    touch, insert = set(), []
+    
+    for ord_, product_id, store_id, price, is_on_sale, timestamp in snapshots:
+        # 1. Exact timestamp match: only refresh seenAt
+        existing_id = exact_ids.get(ord_)
+        if existing_id is not None:
+            touch.add(existing_id)
+            continue
+        if (product_id, store_id, timestamp) in pending:
+            continue
+        
+        # 2. Debounce: latest snapshot has the same price and sale status
+        key = (product_id, store_id)
+        prev = latest_by_key.get(key)
+        if prev and abs(prev[1] - price) < 0.01 and prev[2] == is_on_sale:
+            if prev[0] is not None:
+                touch.add(prev[0])
+            continue
+        
+        insert.append(ord_)
+        # timestamp(3) column: only a ms-aligned value can match the stored one exactly
+        if timestamp.microsecond % 1000 == 0:
+            pending.add((product_id, store_id, timestamp))
+        if prev is None or timestamp >= prev[3]:
+            latest_by_key[key] = (None, price, is_on_sale, timestamp)
+    
+    return touch, insert
+
+async def save_price_snapshots(retailer_id: int, snapshots: List[tuple]) -> int:
+    """
+    Write a batch of snapshots with create_price_snapshot semantics in a handful of statements.
+    
+    `snapshots` are (ord, product_id, store_id, price, is_on_sale, timestamp) tuples, ord
+    being the row position. Rows are COPYed into a temp staging table, existing exact/latest
+    snapshots are fetched with two set-based joins, the debounce is decided in Python and
+    the result applied with one UPDATE and one binary COPY of the new rows - all in one
+    transaction. Returns the number of snapshots inserted or touched.
+    """
+    if not snapshots: return 0
+    pool = await get_pool()
+    if not pool: return 0
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            return await _save_price_snapshots(conn, retailer_id, snapshots)
+
+CREATE_SNAPSHOT_STAGE_SQL = """
+    CREATE TEMP TABLE snapshot_stage (
+        ord INT, product_id INT, store_id INT,
+        price FLOAT8, is_on_sale BOOLEAN, ts TIMESTAMP
+    ) ON COMMIT DROP
+"""
+EXACT_SNAPSHOTS_SQL = """
+    SELECT DISTINCT ON (st.ord) st.ord, ps.id
+    FROM snapshot_stage st
+    JOIN price_snapshots ps
+      ON ps."productId" = st.product_id
+     AND ps."retailerId" = $1
+     AND (ps."storeId" = st.store_id OR (ps."storeId" IS NULL AND st.store_id IS NULL))
+     AND ps.timestamp = st.ts
+    ORDER BY st.ord, ps.id
+"""
+LATEST_SNAPSHOTS_SQL = """
+    SELECT DISTINCT ON (ps."productId", ps."storeId")
+        ps."productId", ps."storeId", ps.id, ps.price, ps."isOnSale", ps.timestamp
+    FROM price_snapshots ps
+    JOIN (SELECT DISTINCT product_id, store_id FROM snapshot_stage) k
+      ON ps."productId" = k.product_id
+     AND (ps."storeId" = k.store_id OR (ps."storeId" IS NULL AND k.store_id IS NULL))
+    WHERE ps."retailerId" = $1
+    ORDER BY ps."productId", ps."storeId", ps.timestamp DESC, ps."seenAt" DESC
+"""
+TOUCH_SNAPSHOTS_SQL = 'UPDATE price_snapshots SET "seenAt" = NOW() WHERE id = ANY($1::int[])'
+
+async def _save_price_snapshots(conn: asyncpg.Connection, retailer_id: int, snapshots: List[tuple]) -> int:
+    """
+    save_price_snapshots on a connection the caller already holds, inside its transaction.
+    
+    Snapshots are append-only history, so the transaction commits without waiting for the
+    WAL flush (SET LOCAL synchronous_commit): a crash may lose the last moments of
+    snapshots, never corrupt them. Callers keep the upserts in a separate transaction.
+    """
+    await conn.execute("SET LOCAL synchronous_commit = OFF")
+    await conn.execute(CREATE_SNAPSHOT_STAGE_SQL)
+    await conn.copy_records_to_table("snapshot_stage", records=snapshots)
+    
+    exact = await conn.fetch(EXACT_SNAPSHOTS_SQL, retailer_id)
+    latest = await conn.fetch(LATEST_SNAPSHOTS_SQL, retailer_id)
+    
+    touch, insert = _debounce_snapshots(snapshots, exact, latest)
+    if touch:
+        # In id order, so concurrent batches touching the same snapshots lock them alike
+        await conn.execute(TOUCH_SNAPSHOTS_SQL, sorted(touch))
+    if insert:
+        # Append-only: binary COPY straight into the table ("seenAt" defaults to NOW())
+        await conn.copy_records_to_table(
+            "price_snapshots",
+            records=[(snapshots[ord_][1], retailer_id, *snapshots[ord_][2:]) for ord_ in insert],
+            columns=["productId", "retailerId", "storeId", "price", "isOnSale", "timestamp"],
+        )
+    return len(touch) + len(insert)
+
+UPSERT_STORES_SQL = """
+    INSERT INTO stores ("retailerId", "externalId", name, city, address, "createdAt", "updatedAt")
+    SELECT $1, e, n, c, a, NOW(), NOW()
+    FROM UNNEST($2::text[], $3::text[], $4::text[], $5::text[]) AS t(e, n, c, a)
+    ON CONFLICT ("retailerId", "externalId") 
+    DO UPDATE SET 
+        name = COALESCE(NULLIF(NULLIF(EXCLUDED.name, ''), 'Store ' || EXCLUDED."externalId"), stores.name),
+        city = COALESCE(NULLIF(EXCLUDED.city, ''), stores.city),
+        address = COALESCE(NULLIF(EXCLUDED.address, ''), stores.address),
+        "updatedAt" = NOW()
+    WHERE (stores.name, stores.city, stores.address) IS DISTINCT FROM (
+        COALESCE(NULLIF(NULLIF(EXCLUDED.name, ''), 'Store ' || EXCLUDED."externalId"), stores.name),
+        COALESCE(NULLIF(EXCLUDED.city, ''), stores.city),
+        COALESCE(NULLIF(EXCLUDED.address, ''), stores.address))
+    RETURNING "externalId", id
+"""
+SELECT_STORE_IDS_SQL = """
+    SELECT "externalId", id FROM stores WHERE "retailerId" = $1 AND "externalId" = ANY($2::text[])
+"""
+
+async def _upsert_stores(conn: asyncpg.Connection, retailer_db_id: int, stores: List[tuple]) -> Dict[str, int]:
+    """
+    Upsert (external_id, name, city, address) tuples of one retailer with upsert_store
+    semantics, one UNNEST statement per conflict round (and UNNEST_CHUNK_ROWS stores).
+    Returns {external_id: store id}.
+    The "Store <id>" placeholder name only applies to new stores.
+    """
+    ids: Dict[str, int] = {}
+    for batch in _conflict_rounds(stores):
+        for chunk in _chunked(batch, UNNEST_CHUNK_ROWS):
+            rows = await conn.fetch(UPSERT_STORES_SQL, retailer_db_id, *map(list, zip(*chunk)))
+            ids.update((row['externalId'], row['id']) for row in rows)
+    
+    # Unchanged stores are not returned by the upsert
+    missing = list({store[0] for store in stores} - ids.keys())
+    if missing:
+        rows = await conn.fetch(SELECT_STORE_IDS_SQL, retailer_db_id, missing)
+        ids.update((row['externalId'], row['id']) for row in rows)
+    return ids
+
 async def save_parsed_stores(rows: List[Dict], retailer_id: str) -> int:
-    db_retailer_id = await upsert_retailer(retailer_id, retailer_id)
-    if not db_retailer_id: return 0
-    count = 0
-    for row in rows:
-        if await upsert_store(db_retailer_id, row.get("external_id"), row.get("name"), row.get("city"), row.get("address")):
-            count += 1
+    pool = await get_pool()
+    if not pool: return 0
+    stores = [
+        (row["external_id"], row.get("name") or f"Store {row['external_id']}", row.get("city"), row.get("address"))
+        for row in rows if row.get("external_id")
+    ]
+    db_retailer_id = _cached_id(_retailer_ids, (retailer_id, retailer_id))
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if db_retailer_id is None:
+                db_retailer_id = await _upsert_retailer(conn, retailer_id, retailer_id)
+            if not db_retailer_id or not stores: return 0
+            await _upsert_stores(conn, db_retailer_id, stores)
+    _remember_retailer(retailer_id, retailer_id, db_retailer_id, time.monotonic())
+    # Store metadata may have changed, so cached store rows of this retailer no longer apply
+    _store_ids.pop(db_retailer_id, None)
+    count = len(stores)
+    logger.info(f"db.stores_saved retailer={retailer_id} count={count}/{len(rows)}")
     return count
 
 async def save_parsed_prices(rows: List[Dict], retailer_id: str, retailer_name: str, store_metadata: Dict = None) -> int:
     if not rows: return 0
-    db_retailer_id = await upsert_retailer(retailer_id, retailer_name)
-    if not db_retailer_id: return 0
+    pool = await get_pool()
+    if not pool: return 0
     
-    saved_count = 0
-    store_cache = {}
+    products = []
+    priced = []
     
     # Extract store metadata from the first row or from store_metadata parameter
     # store_metadata comes from parse_prices_xml and contains city/address from XML root
@@ -220,32 +648,77 @@ async def save_parsed_prices(rows: List[Dict], retailer_id: str, retailer_name:
     default_store_city = store_metadata.get("city") if store_metadata else None
     default_store_address = store_metadata.get("address") if store_metadata else None
 
+    # Rows without a (parseable) date are stamped with the time the batch is saved
+    now = datetime.utcnow()
+    date_formats = list(_DATE_FORMATS)
+    default_store_id = store_metadata.get("store_id") if store_metadata else None
     for row in rows:
-        try:
-            price = float(row.get("price", "0"))
-        except: continue
+        # Rows come in different shapes (items vs promotions), so fields are read with .get
+        get = row.get
+        price = _parse_price(get("price", "0"))
+        if price is None: continue
         
-        timestamp = datetime.utcnow()
-        if row.get("date"):
-            try: timestamp = datetime.strptime(row.get("date")[:19], "%Y-%m-%d %H:%M:%S")
-            except: pass
-
-        # 1. Upsert Store with metadata (city, address) if available
-        db_store_id = None
-        ext_store_id = row.get("store_id") or (store_metadata.get("store_id") if store_metadata else None)
-        if ext_store_id:
-            if ext_store_id in store_cache:
-                db_store_id = store_cache[ext_store_id]
-            else:
-                # Use metadata from XML if available, otherwise just use store_id
-                db_store_id = await upsert_store(
-                    db_retailer_id, 
-                    ext_store_id,
-                    name=default_store_name,
-                    city=default_store_city,
-                    address=default_store_address
-                )
-                if db_store_id: store_cache[ext_store_id] = db_store_id
+        timestamp = now
+        date = get("date")
+        if date:
+            timestamp = _parse_timestamp(date, date_formats) or now
+
+        # 1. Queue Store and Product; both are upserted together below
+        ext_store_id = get("store_id") or default_store_id
+        barcode = get("barcode", "")
+        products.append((
+            barcode,
+            get("name"),
+            get("brand"),
+            get("quantity"),
+            get("unit"),
+            get("is_weighted", False),
+            get("image_url")
+        ))
+        priced.append((barcode, ext_store_id, price, bool(get("is_on_sale", False)), timestamp))
+
+    # 2. Upsert the retailer and the batch's distinct stores in one statement, with metadata
+    # (city, address) from the XML if available, otherwise just the store_id.
+    # Rows upserted identically by a recent batch are taken from the id caches instead.
+    ext_store_ids = dict.fromkeys(ext_store_id for _, ext_store_id, *_ in priced if ext_store_id)
+    stores = [
+        (ext_store_id, default_store_name or f"Store {ext_store_id}", default_store_city, default_store_address)
+        for ext_store_id in ext_store_ids
+    ]
+    db_retailer_id = _cached_id(_retailer_ids, (retailer_id, retailer_name))
+    cached_stores = _store_ids.get(db_retailer_id, {}) if db_retailer_id else {}
+    store_ids = {}
+    pending = []
+    for store in stores:
+        db_store_id = _cached_id(cached_stores, store)
+        if db_store_id is None:
+            pending.append(store)
+        else:
+            store_ids[store[0]] = db_store_id
+    if db_retailer_id is None or pending:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if db_retailer_id is None:
+                    db_retailer_id = await _upsert_retailer(conn, retailer_id, retailer_name)
+                    if not db_retailer_id: return 0
+                store_ids.update(await _upsert_stores(conn, db_retailer_id, pending))
+        # Only cache ids once their transaction has committed
+        cached_at = time.monotonic()
+        _remember_retailer(retailer_id, retailer_name, db_retailer_id, cached_at)
+        cached_stores = _store_ids.setdefault(db_retailer_id, {})
+        if len(cached_stores) + len(pending) > STORE_CACHE_MAX:
+            cached_stores.clear()
+        for store in pending:
+            if store[0] in store_ids:
+                cached_stores[store] = (store_ids[store[0]], cached_at)
+
+    # 3. Products and snapshots, split by barcode into chunks that are saved concurrently,
+    # each on its own pooled connection. A barcode's rows stay in one chunk, in row order,
+    # so chunks never touch the same product or snapshot rows.
+    k = min(DB_SAVE_PARALLELISM, pool.get_max_size(), len(priced) // PARALLEL_CHUNK_ROWS + 1)
+    chunks = [([], []) for _ in range(k)]
+    for product, (barcode, ext_store_id, price, is_on_sale, timestamp) in zip(products, priced):
+        db_store_id = store_ids.get(ext_store_id)
 
         # PRICE NORMALIZATION: Convert Agoras to Shekels for storeId 89
         # Store 89 saves prices in Agoras (×100) instead of Shekels
@@ -255,36 +728,58 @@ async def save_parsed_prices(rows: List[Dict], retailer_id: str, retailer_name:
             price = price / 100.0
             logger.debug(f"price.normalized store_id=89 original={original_price} normalized={price}")
 
-        # 2. Upsert Product
-        db_product_id = await upsert_product(
-            barcode=row.get("barcode", ""),
-            name=row.get("name"),
-            brand=row.get("brand"),
-            quantity=row.get("quantity"),
-            unit=row.get("unit"),
-            is_weighted=row.get("is_weighted", False),
-            image_url=row.get("image_url")
-        )
-        
-        # 3. Create Snapshot (with deduplication)
-        if db_product_id:
-            try:
-                snapshot_id = await create_price_snapshot(
-                    product_id=db_product_id,
-                    retailer_id=db_retailer_id,
-                    price=price,
-                    is_on_sale=row.get("is_on_sale", False),
-                    timestamp=timestamp,
-                    store_id=db_store_id
-                )
-                if snapshot_id:
-                    saved_count += 1
-            except Exception as e:
-                logger.error(f"Snapshot insert failed: {e}")
+        chunk_products, chunk_priced = chunks[hash(barcode) % k]
+        chunk_products.append(product)
+        chunk_priced.append((barcode, db_store_id, price, is_on_sale, timestamp))
+
+    counts = await asyncio.gather(*(
+        _save_price_chunk(pool, db_retailer_id, chunk_products, chunk_priced)
+        for chunk_products, chunk_priced in chunks if chunk_products
+    ))
+    saved_count = sum(counts)
 
     logger.info(f"db.saved retailer={retailer_id} count={saved_count}/{len(rows)}")
     return saved_count
 
+async def _save_price_chunk(pool: asyncpg.Pool, db_retailer_id: int, products: List[tuple], priced: List[tuple]) -> int:
+    """
+    Upsert one chunk's products, then write its snapshots, on one pooled connection.
+    Returns the number of snapshots written (inserted or touched).
+    
+    The upserts commit durably first, the snapshots follow in their own transaction, so a
+    failed snapshot write keeps the products. Failures are logged per chunk and count as
+    0 rows instead of raising, so the batch's other chunks are still reported.
+    """
+    async with pool.acquire() as conn:
+        try:
+            async with conn.transaction():
+                product_ids = await _upsert_products(conn, products)
+        except Exception as e:
+            logger.error("db.products_failed retailer_id=%s products=%d rows=%d error=%s",
+                         db_retailer_id, len(products), len(priced), e)
+            return 0
+        
+        # Queue Snapshots; all snapshots of the chunk are written together. Rows repeated
+        # verbatim in a feed (same product, store, price, sale and timestamp) are queued once.
+        queued = dict.fromkeys(
+            (product_ids[barcode], db_store_id, price, is_on_sale, timestamp)
+            for barcode, db_store_id, price, is_on_sale, timestamp in priced if barcode in product_ids
+        )
+        snapshots = [(ord_, *snapshot) for ord_, snapshot in enumerate(queued)]
+        if not snapshots:
+            return 0
+        
+        async def write_snapshots():
+            async with conn.transaction():
+                return await _save_price_snapshots(conn, db_retailer_id, snapshots)
+        
+        try:
+            return await _retrying(write_snapshots, "save_price_snapshots")
+        except Exception as e:
+            logger.error("db.snapshots_failed retailer_id=%s snapshots=%d error=%s",
+                         db_retailer_id, len(snapshots), e)
+            return 0
+
 
 async def fetch_stores_with_retailer() -> List[Dict]:
     """Fetch all stores with their retailer information."""
@@ -292,24 +787,23 @@ async def fetch_stores_with_retailer() -> List[Dict]:
     if not pool: return []
     
     try:
-        async with pool.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT 
-                    s.id,
-                    s."externalId",
-                    s.name,
-                    s.city,
-                    s.address,
-                    s."createdAt",
-                    s."updatedAt",
-                    r.id as "retailerId",
-                    r.name as "retailerName",
-                    r.slug as "retailerSlug"
-                FROM stores s
-                INNER JOIN retailers r ON s."retailerId" = r.id
-                ORDER BY s."createdAt" DESC
-            """)
-            return [dict(row) for row in rows]
+        rows = await pool.fetch("""
+            SELECT 
+                s.id,
+                s."externalId",
+                s.name,
+                s.city,
+                s.address,
+                s."createdAt",
+                s."updatedAt",
+                r.id as "retailerId",
+                r.name as "retailerName",
+                r.slug as "retailerSlug"
+            FROM stores s
+            INNER JOIN retailers r ON s."retailerId" = r.id
+            ORDER BY s."createdAt" DESC
+        """)
+        return [dict(row) for row in rows]
     except Exception as e:
         logger.error(f"db.fetch_stores.failed error={e}")
         return []
@@ -1,12 +1,22 @@
 # crawler/download.py
 from __future__ import annotations
+import asyncio
+import functools
 import re
+from typing import Awaitable, Callable, Iterable, Optional, Set
 from urllib.parse import urlparse
 
+import httpx
 from playwright.async_api import Page
 
 from . import logger
+from .archive_utils import sniff_kind, md5_hex
+from .constants import DOWNLOAD_CONCURRENCY
+from .models import RetailerResult
 from .parsers import parse_from_blob
+from .utils import canonical_url
+
+_CD_FILENAME_RE = re.compile(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)\"?", re.IGNORECASE)
 
 
 def _resp_headers(resp) -> dict:
@@ -23,35 +33,42 @@ def _resp_headers(resp) -> dict:
             return {}
 
 
+def url_filename(url: str) -> str:
+    """Last path segment of url, the name a download gets without Content-Disposition."""
+    return urlparse(url).path.split('/')[-1] or "download"
+
+
 def pick_filename(resp, fallback: str) -> str:
     """Extract filename from Content-Disposition header, fallback to provided name."""
     cd = _resp_headers(resp).get("content-disposition") or ""
-    m = re.search(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)\"?", cd, re.IGNORECASE)
+    m = _CD_FILENAME_RE.search(cd)
     if m:
         return m.group(1)
     return fallback
 
 
+def _usable_status(status: int, url: str) -> bool:
+    """False for 404/403 (broken links are skipped); raise for any other non-2xx status."""
+    # Handle 404 (Not Found) and 403 (Forbidden) - skip broken links
+    if status in (404, 403):
+        logger.warning(f"Skipping broken link: {url}")
+        return False
+
+    # Raise error for other non-OK statuses
+    if not 200 <= status < 300:
+        raise RuntimeError(f"download_failed status={status}")
+    return True
+
+
 async def fetch_url(page: Page, url: str) -> tuple[bytes | None, object | None, str | None]:
     """Download URL and return (data, response, filename). Returns (None, None, None) for 404/403 errors."""
     try:
         resp = await page.request.get(url, timeout=90000)
-        
-        # Handle 404 (Not Found) and 403 (Forbidden) - skip broken links
-        if resp.status == 404:
-            logger.warning(f"Skipping broken link: {url}")
-            return None, None, None
-        if resp.status == 403:
-            logger.warning(f"Skipping broken link: {url}")
+        if not _usable_status(resp.status, url):
             return None, None, None
         
-        # Raise error for other non-OK statuses
-        if not resp.ok:
-            raise RuntimeError(f"download_failed status={resp.status}")
-        
         data = await resp.body()
-        fallback = urlparse(url).path.split('/')[-1] or "download"
-        fname = pick_filename(resp, fallback)
+        fname = pick_filename(resp, url_filename(url))
         return data, resp, fname
     
     except Exception as e:
@@ -60,6 +77,90 @@ async def fetch_url(page: Page, url: str) -> tuple[bytes | None, object | None,
         return None, None, None
 
 
+async def fetch_url_http(client: httpx.AsyncClient, url: str) -> tuple[bytes | None, object | None, str | None]:
+    """fetch_url over a plain HTTP client, for static file hosts that need no browser session."""
+    try:
+        resp = await client.get(url, timeout=90.0)
+        if not _usable_status(resp.status_code, url):
+            return None, None, None
+
+        fname = pick_filename(resp, url_filename(url))
+        return resp.content, resp, fname
+
+    except Exception as e:
+        # Catch any network/request errors and log them
+        logger.warning(f"Skipping broken link: {url} (error: {e})")
+        return None, None, None
+
+
+async def download_links(page: Page, links: Iterable[str], retailer_id: str, seen_hashes: Set[str],
+                         seen_names: Set[str], run_id: str, result: RetailerResult,
+                         fetch: Optional[Callable[[str], Awaitable[tuple]]] = None) -> None:
+    """
+    Download, dedupe and parse links, up to DOWNLOAD_CONCURRENCY at a time.
+    Links are fetched through the page's browser context unless another fetch
+    (with fetch_url's return shape) is given. The files' DB saves run one at a
+    time: they share the retailer's stores and most products, so concurrent
+    saves would only contend for the same rows.
+    Counters and errors are recorded on result.
+    """
+    if fetch is None:
+        fetch = functools.partial(fetch_url, page)
+    sem = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    save_lock = asyncio.Lock()
+
+    async def _one(link: str) -> None:
+        filename = link.split('/')[-1] or link  # Fallback for error logging
+        try:
+            async with sem:
+                data, resp, filename = await fetch(link)
+                if data is None:
+                    return
+                kind = sniff_kind(data)
+                md5_hash = md5_hex(data)
+
+                # Check for duplicates (no await between check and add, so concurrent
+                # downloads of the same file cannot both get through)
+                if md5_hash in seen_hashes:
+                    result.skipped_dupes += 1
+                    return
+
+                # Normalize filename for name-based dedupe
+                normalized_name = f"{retailer_id}/{filename.lower()}"
+                if normalized_name in seen_names:
+                    result.skipped_dupes += 1
+                    return
+
+                # Add to seen sets
+                seen_hashes.add(md5_hash)
+                seen_names.add(normalized_name)
+
+                # Unified parse (logs file.downloaded, extracts, parses, logs file.processed)
+                await parse_from_blob(data, filename, retailer_id, run_id, save_lock=save_lock)
+
+            # Update counters based on sniffed kind (not filename extension)
+            if kind == "zip":
+                result.zips += 1
+            elif kind == "gz":
+                result.gz += 1
+            result.files_downloaded += 1
+
+        except Exception as e:
+            result.errors.append(f"download_error:{link}:{e}")
+            logger.error("download.failed retailer=%s link=%s file=%s err=%s", retailer_id, link, filename, str(e))
+
+    # Variants of one URL (tracking params, fragment, host case) would only be
+    # downloaded again to be skipped as dupes; fetch each file once
+    unique = {}
+    for link in links:
+        key = canonical_url(link)
+        if key in unique:
+            result.skipped_dupes += 1
+        else:
+            unique[key] = link
+    await asyncio.gather(*(_one(link) for link in unique.values()))
+
+
 async def maybe_parse_to_jsonl(retailer_id: str, filename: str, data: bytes, run_id: str = ""):
     """Legacy wrapper - routes to unified parse_from_blob."""
     try:
@@ -1,12 +1,29 @@
 # crawler/parsers.py
 from __future__ import annotations
+import asyncio
+import contextlib
+import io
+import multiprocessing
 import re
-from typing import List, Optional, Tuple, Dict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, List, Optional, Tuple, Dict, Union
 from lxml import etree
 from . import logger
-from .archive_utils import iter_xml_entries, sniff_kind
+from .archive_utils import iter_xml_streams, sniff_kind
+from .constants import PARSE_WORKERS
 from .db import save_parsed_prices, save_parsed_stores
 
+_STORE_ID_RE = re.compile(r"(\d+)-(\d+)-\d+")
+
+# Candidate tags for an item's image URL
+_IMAGE_TAGS = ("ItemImage", "Image", "ImageUrl", "ImageURL",
+               "Picture", "PictureUrl", "Photo", "PhotoUrl",
+               "תמונה", "קישור_תמונה")  # Hebrew: image, image link
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_broken = False
+
 
 def _first_text(elem, *paths) -> Optional[str]:
     """Returns the RAW text found in paths. No cleaning/filtering."""
@@ -18,35 +35,71 @@ def _first_text(elem, *paths) -> Optional[str]:
     return None
 
 
+def _child_texts(elem) -> Dict[str, Optional[str]]:
+    """Map each child tag to the RAW text of its first occurrence, in a single pass."""
+    texts: Dict[str, Optional[str]] = {}
+    for c in elem:
+        if isinstance(c.tag, str) and c.tag not in texts:
+            texts[c.tag] = c.text
+    return texts
+
+
+def _pick(texts: Dict[str, Optional[str]], *tags) -> Optional[str]:
+    """Same lookup as _first_text, but against a map built by _child_texts."""
+    for t in tags:
+        v = texts.get(t)
+        if v:
+            v = v.strip()
+            if v: return v
+    return None
+
+
 def extract_store_id(filename: str) -> Optional[str]:
     """Extracts store ID from filename (e.g. '004' from 'PriceFull...-004-...')"""
-    match = re.search(r"(\d+)-(\d+)-\d+", filename)
+    match = _STORE_ID_RE.search(filename)
     if match: return match.group(2)
     return None
 
 
-def parse_stores_xml(xml_bytes: bytes) -> List[dict]:
+def _as_stream(xml: Union[bytes, BinaryIO]) -> BinaryIO:
+    """Accept raw XML bytes or an already-open (possibly decompressing) stream."""
+    return io.BytesIO(xml) if isinstance(xml, (bytes, bytearray)) else xml
+
+
+def _release(elem) -> None:
+    """Free a fully-processed element (and its already-processed siblings) during iterparse."""
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is None:
+        return
+    prev = elem.getprevious()
+    while prev is not None and prev.tag == elem.tag:
+        parent.remove(prev)
+        prev = elem.getprevious()
+
+
+def parse_stores_xml(xml_bytes: Union[bytes, BinaryIO]) -> List[dict]:
     rows = []
     try:
-        root = etree.fromstring(xml_bytes)
-        for store in root.findall(".//Store"):
-            ext_id = _first_text(store, "StoreId", "StoreID", "storeid")
+        for _, store in etree.iterparse(_as_stream(xml_bytes), events=("end",), tag="Store"):
+            texts = _child_texts(store)
+            ext_id = _pick(texts, "StoreId", "StoreID", "storeid")
             if ext_id:
                 # Try multiple possible address field names (English and Hebrew)
                 address = (
-                    _first_text(store, "Address", "Street", "StoreAddress", 
+                    _pick(texts, "Address", "Street", "StoreAddress", 
                                "AddressLine1", "FullAddress", "Location", 
                                "StreetAddress", "Addr", "StoreLocation",
                                "כתובת", "רחוב", "מיקום", "כתובת_סניף")  # Hebrew: address, street, location
                 )
-                city = _first_text(store, "City", "CityName", "StoreCity",
+                city = _pick(texts, "City", "CityName", "StoreCity",
                                    "עיר", "יישוב")  # Hebrew: city, settlement
-                name = _first_text(store, "StoreName", "StoreNm", "Name", "StoreName",
+                name = _pick(texts, "StoreName", "StoreNm", "Name", "StoreName",
                                   "שם_סניף", "סניף", "שם")  # Hebrew: branch name, branch, name
                 
-                # Log if we found address data
+                # Log if we found address data (per store, so debug-only and formatted lazily)
                 if address or city:
-                    logger.info(f"parse_stores_xml found store ext_id={ext_id} name={name} city={city} address={address}")
+                    logger.debug("parse_stores_xml found store ext_id=%s name=%s city=%s address=%s", ext_id, name, city, address)
                 
                 rows.append({
                     "external_id": ext_id,
@@ -54,25 +107,166 @@ def parse_stores_xml(xml_bytes: bytes) -> List[dict]:
                     "city": city,
                     "address": address
                 })
+            _release(store)
     except Exception as e:
         logger.warning(f"Failed to parse stores XML: {e}")
     return rows
 
 
-def parse_prices_xml(xml_bytes: bytes, company: str, store_id: str = None) -> Tuple[List[Dict], Dict]:
+def _price_row(it, company: str) -> Optional[Dict]:
+    """Build a price row from an <Item> element, or None if it has no usable price."""
+    texts = _child_texts(it)
+    barcode = _pick(texts, "ItemCode", "Barcode")
+    regular_price_str = _pick(texts, "ItemPrice", "Price", "RegularPrice", "ListPrice")
+    promotion_price_str = _pick(texts, "PromotionPrice", "DiscountedPrice", "SalePrice", "DiscountPrice")
+    
+    # Determine which price to use and if on sale
+    price_str = None
+    is_on_sale = False
+    
+    if promotion_price_str and regular_price_str:
+        # Both prices exist - compare them
+        try:
+            regular_price = float(regular_price_str)
+            promotion_price = float(promotion_price_str)
+            # Only mark as sale if promotion price is actually lower
+            if promotion_price < regular_price:
+                price_str = promotion_price_str
+                is_on_sale = True
+            else:
+                # Promotion price >= regular price, use regular price (not a real sale)
+                price_str = regular_price_str
+                is_on_sale = False
+        except (ValueError, TypeError):
+            # If parsing fails, fall back to regular price
+            price_str = regular_price_str
+            is_on_sale = False
+    elif promotion_price_str:
+        # Only promotion price exists - use it but mark as sale
+        price_str = promotion_price_str
+        is_on_sale = True
+    elif regular_price_str:
+        # Only regular price exists
+        price_str = regular_price_str
+        is_on_sale = False
+    else:
+        # No price found, skip this item
+        return None
+    
+    if not (barcode and price_str): return None
+
+    # Extract Raw Metadata
+    qty_str = _pick(texts, "Quantity", "Content", "QtyInPackage")
+    qty = None
+    if qty_str:
+        try: qty = float(qty_str)
+        except: pass # Keep None if not a valid number
+    
+    weighted_str = _pick(texts, "bIsWeighted", "BisWeighted")
+    is_weighted = (weighted_str and weighted_str.lower() in ("1", "true", "y"))
+
+    # Extract image URL if available
+    image_url = _pick(texts, *_IMAGE_TAGS)
+    
+    return {
+        "name": _pick(texts, "ItemName", "ItemNm", "ItemDescription", "Description"),
+        "barcode": barcode,
+        "date": _pick(texts, "PriceUpdateDate", "UpdateDate"),
+        "price": price_str,
+        "company": company,
+        "store_id": None,  # filled in once store metadata is known
+        "is_on_sale": is_on_sale,
+        "brand": _pick(texts, "ManufacturerName", "BrandName"),
+        "unit": _pick(texts, "UnitQty", "UnitOfMeasure"),
+        "quantity": qty,
+        "is_weighted": is_weighted,
+        "image_url": image_url
+    }
+
+
+def _promo_rows(promo, company: str) -> List[Dict]:
+    """Build sale rows for every <Item> inside a <Promotion> element."""
+    rows: List[Dict] = []
+    promo_texts = _child_texts(promo)
+    price = _pick(promo_texts, "DiscountedPrice", "DiscountRate")
+    date = _pick(promo_texts, "PromotionUpdateDate", "UpdateDate", "PromotionStartDate")
+    
+    if not price: return rows
+    
+    # Everything but barcode/image is shared by all items of the promotion
+    template = {
+        "barcode": None,
+        "price": price,
+        "date": date,
+        "company": company,
+        "store_id": None,  # filled in once store metadata is known
+        "is_on_sale": True,
+        "name": None, # Promos often lack names
+        "image_url": None
+    }
+    
+    for item in promo.iter("Item"):
+        texts = _child_texts(item)
+        barcode = _pick(texts, "ItemCode", "Barcode")
+        if barcode:
+            row = template.copy()
+            row["barcode"] = barcode
+            # Extract image URL if available
+            row["image_url"] = _pick(texts, *_IMAGE_TAGS)
+            rows.append(row)
+    return rows
+
+
+def parse_prices_xml(xml_bytes: Union[bytes, BinaryIO], company: str, store_id: str = None) -> Tuple[List[Dict], Dict]:
     """
     Parse price XML and return (price_rows, store_metadata).
     
+    The document is streamed with lxml.iterparse: each <Item>/<Promotion> is turned
+    into rows as soon as it is complete and then released, so peak memory stays flat
+    regardless of file size. Accepts raw bytes or a readable stream (see
+    archive_utils.iter_xml_streams).
+    
     Returns:
         tuple: (list of price items, dict with store metadata: {store_id, name, city, address})
     """
-    rows: List[dict] = []
+    promo_rows: List[dict] = []
+    price_rows: List[dict] = []
     store_metadata = {}
+    saw_item = False
+    promo_depth = 0
     
     try:
-        root = etree.fromstring(xml_bytes)
+        context = etree.iterparse(_as_stream(xml_bytes), events=("start", "end"),
+                                  tag=("Item", "Promotion"))
+        for event, elem in context:
+            if elem.tag == "Promotion":
+                if event == "start":
+                    promo_depth += 1
+                    continue
+                promo_depth -= 1
+                # 1. Handle PROMOS (Promo/PromoFull)
+                # Price is in "DiscountedPrice", IS on sale
+                promo_rows.extend(_promo_rows(elem, company))
+                _release(elem)
+            elif event == "end":
+                # 2. Handle PRICES (Price/PriceFull)
+                # Some retailers have both regular price and promotion price in the same Item element
+                # We need to compare them to determine if item is actually on sale
+                saw_item = True
+                row = _price_row(elem, company)
+                if row: price_rows.append(row)
+                # Items nested in a Promotion are still needed by the Promotion handler
+                if not promo_depth:
+                    _release(elem)
+        root = context.root
     except Exception:
-        return rows, store_metadata
+        return [], store_metadata
+
+    # Files without <Item> elements list their products as direct children of the root
+    if not saw_item:
+        for it in root:
+            row = _price_row(it, company)
+            if row: price_rows.append(row)
 
     # Extract store metadata from root level (if present in price files)
     # Some retailers embed store info in price XML files
@@ -119,112 +313,60 @@ def parse_prices_xml(xml_bytes: bytes, company: str, store_id: str = None) -> Tu
     # Use store_id from metadata if we found it and it wasn't passed in
     effective_store_id = store_metadata.get("store_id") or store_id
 
-    # 1. Handle PROMOS (Promo/PromoFull)
-    # Price is in "DiscountedPrice", IS on sale
-    for promo in root.findall(".//Promotion"):
-        price = _first_text(promo, "DiscountedPrice", "DiscountRate")
-        date = _first_text(promo, "PromotionUpdateDate", "UpdateDate", "PromotionStartDate")
-        
-        if not price: continue
-        
-        for item in promo.findall(".//Item"):
-            barcode = _first_text(item, "ItemCode", "Barcode")
-            if barcode:
-                # Extract image URL if available
-                image_url = _first_text(item, "ItemImage", "Image", "ImageUrl", "ImageURL",
-                                       "Picture", "PictureUrl", "Photo", "PhotoUrl",
-                                       "תמונה", "קישור_תמונה")  # Hebrew: image, image link
-                rows.append({
-                    "barcode": barcode,
-                    "price": price,
-                    "date": date,
-                    "company": company,
-                    "store_id": effective_store_id,
-                    "is_on_sale": True,
-                    "name": None, # Promos often lack names
-                    "image_url": image_url
-                })
-
-    # 2. Handle PRICES (Price/PriceFull)
-    # Some retailers have both regular price and promotion price in the same Item element
-    # We need to compare them to determine if item is actually on sale
-    items = root.findall(".//Item")
-    if not items: items = list(root)
-    
-    for it in items:
-        barcode = _first_text(it, "ItemCode", "Barcode")
-        regular_price_str = _first_text(it, "ItemPrice", "Price", "RegularPrice", "ListPrice")
-        promotion_price_str = _first_text(it, "PromotionPrice", "DiscountedPrice", "SalePrice", "DiscountPrice")
-        
-        # Determine which price to use and if on sale
-        price_str = None
-        is_on_sale = False
-        
-        if promotion_price_str and regular_price_str:
-            # Both prices exist - compare them
-            try:
-                regular_price = float(regular_price_str)
-                promotion_price = float(promotion_price_str)
-                # Only mark as sale if promotion price is actually lower
-                if promotion_price < regular_price:
-                    price_str = promotion_price_str
-                    is_on_sale = True
-                else:
-                    # Promotion price >= regular price, use regular price (not a real sale)
-                    price_str = regular_price_str
-                    is_on_sale = False
-            except (ValueError, TypeError):
-                # If parsing fails, fall back to regular price
-                price_str = regular_price_str
-                is_on_sale = False
-        elif promotion_price_str:
-            # Only promotion price exists - use it but mark as sale
-            price_str = promotion_price_str
-            is_on_sale = True
-        elif regular_price_str:
-            # Only regular price exists
-            price_str = regular_price_str
-            is_on_sale = False
-        else:
-            # No price found, skip this item
-            continue
-        
-        if not (barcode and price_str): continue
-
-        # Extract Raw Metadata
-        qty_str = _first_text(it, "Quantity", "Content", "QtyInPackage")
-        qty = None
-        if qty_str:
-            try: qty = float(qty_str)
-            except: pass # Keep None if not a valid number
-        
-        weighted_str = _first_text(it, "bIsWeighted", "BisWeighted")
-        is_weighted = (weighted_str and weighted_str.lower() in ("1", "true", "y"))
-
-        # Extract image URL if available
-        image_url = _first_text(it, "ItemImage", "Image", "ImageUrl", "ImageURL", 
-                               "Picture", "PictureUrl", "Photo", "PhotoUrl",
-                               "תמונה", "קישור_תמונה")  # Hebrew: image, image link
-        
-        rows.append({
-            "name": _first_text(it, "ItemName", "ItemNm", "ItemDescription", "Description"),
-            "barcode": barcode,
-            "date": _first_text(it, "PriceUpdateDate", "UpdateDate"),
-            "price": price_str,
-            "company": company,
-            "store_id": effective_store_id,
-            "is_on_sale": is_on_sale,
-            "brand": _first_text(it, "ManufacturerName", "BrandName"),
-            "unit": _first_text(it, "UnitQty", "UnitOfMeasure"),
-            "quantity": qty,
-            "is_weighted": is_weighted,
-            "image_url": image_url
-        })
+    rows = promo_rows + price_rows
+    for row in rows:
+        row["store_id"] = effective_store_id
     
     return rows, store_metadata
 
 
-async def parse_from_blob(data: bytes, filename_hint: str, retailer_id: str, run_id: str) -> int:
+def _get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """Lazily start the parser process pool (None when PARSE_WORKERS=0)."""
+    global _parse_pool
+    if PARSE_WORKERS <= 0 or _parse_pool_broken:
+        return None
+    if _parse_pool is None:
+        # spawn: never fork a process that holds Playwright/asyncpg state
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                          mp_context=multiprocessing.get_context("spawn"))
+    return _parse_pool
+
+
+async def shutdown_parse_pool() -> None:
+    """Stop the parser workers; the next parse starts a fresh pool."""
+    global _parse_pool
+    pool, _parse_pool = _parse_pool, None
+    if pool is not None:
+        # Joining the workers blocks, so it happens off the event loop
+        await asyncio.to_thread(pool.shutdown)
+
+
+def _parse_entries(data: bytes, filename_hint: str, company: str,
+                   is_store_file: bool, store_ext_id: Optional[str]) -> List[Tuple[List[dict], Optional[Dict]]]:
+    """Parse every XML entry in a blob into (rows, store_metadata) pairs. Runs in a pool worker."""
+    parsed = []
+    # Stream each entry straight from the archive into the parser; the
+    # decompressed XML is never held in memory as a whole.
+    for inner_name, xml_stream in iter_xml_streams(data, filename_hint=filename_hint):
+        try:
+            if is_store_file:
+                parsed.append((parse_stores_xml(xml_stream), None))
+            else:
+                parsed.append(parse_prices_xml(xml_stream, company=company, store_id=store_ext_id))
+        except Exception as e:
+            logger.warning(f"Parse error: {e}")
+            parsed.append(([], None))
+    return parsed
+
+
+async def parse_from_blob(data: bytes, filename_hint: str, retailer_id: str, run_id: str,
+                          save_lock: Optional[asyncio.Lock] = None) -> int:
+    """
+    Parse a downloaded blob and save its rows. Returns the number of XML entries handled.
+    
+    Files parsed concurrently can share save_lock: parsing still overlaps, but their DB
+    saves run one at a time.
+    """
     kind = sniff_kind(data)
     logger.info("file.downloaded retailer=%s file=%s kind=%s bytes=%d", retailer_id, filename_hint, kind, len(data))
     
@@ -232,18 +374,33 @@ async def parse_from_blob(data: bytes, filename_hint: str, retailer_id: str, run
     is_store_file = "Store" in filename_hint and "Price" not in filename_hint
     store_ext_id = extract_store_id(filename_hint) if not is_store_file else None
 
-    count = 0
-    for inner_name, xml_bytes in iter_xml_entries(data, filename_hint=filename_hint):
-        count += 1
+    # XML parsing is CPU-bound; run it in the process pool so the event loop keeps
+    # downloading (and other retailers keep crawling) meanwhile.
+    args = (data, filename_hint, retailer_id, is_store_file, store_ext_id)
+    pool = _get_parse_pool()
+    parsed = None
+    if pool is not None:
         try:
-            if is_store_file:
-                rows = parse_stores_xml(xml_bytes)
-                if rows: await save_parsed_stores(rows, retailer_id)
-            else:
-                rows, store_metadata = parse_prices_xml(xml_bytes, company=retailer_id, store_id=store_ext_id)
-                if rows: 
-                    # Pass store metadata to save_parsed_prices so it can update store info
-                    await save_parsed_prices(rows, retailer_id, retailer_id, store_metadata=store_metadata)
-        except Exception as e:
-            logger.warning(f"Parse error: {e}")
+            parsed = await asyncio.get_running_loop().run_in_executor(pool, _parse_entries, *args)
+        except BrokenProcessPool as e:
+            # Workers died (e.g. OOM-killed); parse inline for the rest of the run
+            global _parse_pool_broken
+            _parse_pool_broken = True
+            logger.warning("parse.pool_broken file=%s err=%s falling_back=inline", filename_hint, e)
+    if parsed is None:
+        parsed = _parse_entries(*args)
+
+    count = 0
+    async with save_lock or contextlib.nullcontext():
+        for rows, store_metadata in parsed:
+            count += 1
+            try:
+                if is_store_file:
+                    if rows: await save_parsed_stores(rows, retailer_id)
+                else:
+                    if rows: 
+                        # Pass store metadata to save_parsed_prices so it can update store info
+                        await save_parsed_prices(rows, retailer_id, retailer_id, store_metadata=store_metadata)
+            except Exception as e:
+                logger.warning(f"Parse error: {e}")
     return count
@@ -1,29 +1,114 @@
 # crawler/playwright_helpers.py
 from __future__ import annotations
+import inspect
 import os
+import re
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from importlib import metadata
+from typing import AsyncIterator
 
-from playwright.async_api import Page
+from playwright.async_api import Browser, BrowserContext, Page
 
-from .constants import SCREENSHOTS_DIR
+from . import logger
+from .constants import SCREENSHOTS_DIR, DEBUG_SCREENSHOTS, PW_FAST_STACK
 from .utils import safe_name, ensure_dirs
 
 
-async def new_context(pw):
-    """Create a new Playwright browser context with HTTPS error ignore for legacy portals."""
-    browser = await pw.chromium.launch(
+class _FramesOnlyInspect:
+    """
+    Stand-in for `inspect` inside Playwright's connection layer, which calls
+    inspect.stack() on every API call to name the call in errors. Playwright only
+    reads file/line/function from it, so the source context lines that stack()
+    loads by default are skipped (about half its cost on deep async stacks).
+    """
+
+    def __getattr__(self, name):
+        return getattr(inspect, name)
+
+    @staticmethod
+    def stack(context: int = 0):
+        # [1:] drops this wrapper's own frame, so the stack starts at the caller as before
+        return inspect.stack(context)[1:]
+
+
+# Playwright releases whose private connection layer _FramesOnlyInspect was checked against
+FAST_STACK_PLAYWRIGHT_VERSIONS = ("1.45",)
+
+
+def _install_fast_stack() -> bool:
+    """
+    Swap _FramesOnlyInspect into Playwright's connection layer (PW_FAST_STACK=1).
+    Only on a checked Playwright release whose private modules still look as expected;
+    otherwise Playwright is left untouched. Returns True if the patch was applied.
+    """
+    version = metadata.version("playwright")
+    if ".".join(version.split(".")[:2]) not in FAST_STACK_PLAYWRIGHT_VERSIONS:
+        logger.warning("pw.fast_stack.skipped reason=unsupported_version version=%s", version)
+        return False
+    try:
+        from playwright._impl import _connection, _network
+    except ImportError as e:
+        logger.warning("pw.fast_stack.skipped reason=import_failed version=%s error=%s", version, e)
+        return False
+    if not (getattr(_connection, "inspect", None) is inspect and getattr(_network, "inspect", None) is inspect):
+        logger.warning("pw.fast_stack.skipped reason=no_inspect_attr version=%s", version)
+        return False
+    _connection.inspect = _network.inspect = _FramesOnlyInspect()
+    logger.info("pw.fast_stack.applied version=%s", version)
+    return True
+
+
+# Module import runs once per process, so the patch (and its log line) happens once
+if PW_FAST_STACK:
+    _install_fast_stack()
+
+
+# Images, fonts and media never matter for finding price files; matched by URL so that
+# only these requests (not every request) are intercepted and aborted
+BLOCKED_ASSETS_RE = re.compile(
+    r"\.(?:png|jpe?g|gif|webp|svg|ico|bmp|woff2?|ttf|otf|eot|mp4|webm|mp3|wav)(?:[?#]|$)", re.IGNORECASE
+)
+
+
+async def launch_browser(pw) -> Browser:
+    """Launch the headless Chromium shared by all retailers in a run."""
+    return await pw.chromium.launch(
         headless=True, args=["--no-sandbox", "--disable-dev-shm-usage"]
     )
+
+
+async def new_context(browser: Browser) -> BrowserContext:
+    """Create a new Playwright browser context with HTTPS error ignore for legacy portals."""
     ctx = await browser.new_context(
         locale="he-IL",
         ignore_https_errors=True  # Ignore cert errors for legacy Israeli retail portals
     )
-    return browser, ctx
+    await ctx.route(BLOCKED_ASSETS_RE, lambda route: route.abort())
+    return ctx
+
+
+@asynccontextmanager
+async def context_page(browser: Browser) -> AsyncIterator[Page]:
+    """Yield a page in a fresh context on `browser`; the context is closed on exit."""
+    ctx = await new_context(browser)
+    try:
+        yield await ctx.new_page()
+    finally:
+        await ctx.close()
+
+
+async def debug_screenshot(page: Page, stem: str) -> str | None:
+    """Save a viewport JPEG to SCREENSHOTS_DIR when DEBUG_SCREENSHOTS is on. Returns the filename."""
+    if not DEBUG_SCREENSHOTS:
+        return None
+    ensure_dirs(SCREENSHOTS_DIR)
+    fname = f"{safe_name(stem)}_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.jpg"
+    await page.screenshot(path=os.path.join(SCREENSHOTS_DIR, fname), type="jpeg", quality=60)
+    return fname
 
 
 async def screenshot_after_login(page: Page, display_name: str):
     """Take a screenshot after login for debugging."""
-    ensure_dirs(SCREENSHOTS_DIR)
-    fname = f"{safe_name(display_name)}_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.png"
-    await page.screenshot(path=os.path.join(SCREENSHOTS_DIR, fname), full_page=True)
+    await debug_screenshot(page, display_name)
 
@@ -2,13 +2,18 @@
 from __future__ import annotations
 import os
 import re
+from urllib.parse import urlsplit, urlunsplit
 
 from .constants import VALID_PATTERNS
 
+_UNSAFE_CHARS_RE = re.compile(r"[^\w\-.]+")
+# Query parameters that only track the click and never change what the URL serves
+_TRACKING_PARAM_RE = re.compile(r"^(?:utm_[^=&]*|fbclid|gclid|_ga)(?:=|$)", re.IGNORECASE)
+
 
 def safe_name(s: str) -> str:
     """Sanitize string for use in filenames."""
-    return re.sub(r"[^\w\-.]+", "_", s).strip("_")[:120]
+    return _UNSAFE_CHARS_RE.sub("_", s).strip("_")[:120]
 
 
 def ensure_dirs(*paths: str):
@@ -17,10 +22,20 @@ def ensure_dirs(*paths: str):
         os.makedirs(p, exist_ok=True)
 
 
+# File extensions or price-feed keywords ("price" also covers "pricefull"), in one C-level scan
+_PRICE_FILE_RE = re.compile(
+    "|".join(map(re.escape, VALID_PATTERNS + ("price", "promo", "stores"))), re.IGNORECASE | re.ASCII
+)
+
+
 def looks_like_price_file(url: str) -> bool:
     """Check if URL looks like a price file (hardened to catch mislabeled extensions)."""
-    u = (url or "").lower()
-    if any(p in u for p in VALID_PATTERNS):
-        return True
-    return ("pricefull" in u) or ("promo" in u) or ("stores" in u) or ("price" in u)
+    return bool(url) and _PRICE_FILE_RE.search(url) is not None
+
+
 
+def canonical_url(url: str) -> str:
+    """Dedupe key for url: lower-cased scheme/host, no fragment, no tracking params, no trailing '/'."""
+    p = urlsplit(url)
+    query = "&".join(q for q in p.query.split("&") if q and not _TRACKING_PARAM_RE.match(q))
+    return urlunsplit((p.scheme.lower(), p.netloc.lower(), p.path.rstrip("/") or "/", query, ""))
@@ -36,16 +36,19 @@ async def sync_retailers_from_json():
             logger.warning("Database not available - skipping retailer sync")
             return
         
-        synced = 0
-        for retailer in retailers:
-            retailer_id = retailer.get("id")
-            retailer_name = retailer.get("name")
-            
-            if retailer_id and retailer_name and retailer.get("enabled", True):
+        # Upserts are independent: run them concurrently, leaving a little pool headroom
+        sem = asyncio.Semaphore(max(1, pool.get_max_size() - 2))
+        
+        async def _sync(retailer) -> bool:
+            async with sem:
                 need_creds = _requires_credentials(retailer)
-                db_id = await upsert_retailer(retailer_id, retailer_name, need_creds)
-                if db_id:
-                    synced += 1
+                return bool(await upsert_retailer(retailer["id"], retailer["name"], need_creds))
+        
+        results = await asyncio.gather(*(
+            _sync(retailer) for retailer in retailers
+            if retailer.get("id") and retailer.get("name") and retailer.get("enabled", True)
+        ))
+        synced = sum(results)
         
         logger.info(f"Synced {synced} retailers to database")
     except Exception as e:
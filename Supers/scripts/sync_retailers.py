@@ -36,6 +36,7 @@ async def sync_retailers():
         # Sync each retailer
         synced = 0
         skipped = 0
+        to_sync = []
         
         for retailer in retailers:
             retailer_id = retailer.get("id")
@@ -52,8 +53,17 @@ async def sync_retailers():
                 skipped += 1
                 continue
             
-            # Upsert retailer (will insert if new, update if exists)
-            db_id = await upsert_retailer(retailer_id, retailer_name)
+            to_sync.append((retailer_id, retailer_name))
+        
+        # Upsert retailers (insert if new, update if exists) concurrently, leaving pool headroom
+        sem = asyncio.Semaphore(max(1, pool.get_max_size() - 2))
+        
+        async def _upsert(retailer_id: str, retailer_name: str):
+            async with sem:
+                return await upsert_retailer(retailer_id, retailer_name)
+        
+        db_ids = await asyncio.gather(*(_upsert(*item) for item in to_sync))
+        for (retailer_id, retailer_name), db_id in zip(to_sync, db_ids):
             if db_id:
                 synced += 1
                 logger.info(f"✓ Synced: {retailer_id} ({retailer_name})")
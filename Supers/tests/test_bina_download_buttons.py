@@ -0,0 +1,88 @@
+"""
+Test for the Bina Download() button scan (_DOWNLOAD_BUTTONS_JS).
+
+Each reported button must carry the onclick filename, the date of its own
+table row, and a buttonIndex that selects that same button through
+locator(...).nth(), which is how bina_fallback_click_downloads clicks it.
+"""
+import pytest
+from playwright.async_api import async_playwright
+
+
+BUTTON_SELECTOR = "button[onclick*='Download'], button[onclick*='download']"
+
+# Several buttons per page: a nested table, a button outside any row, rows
+# without a date and non-archive downloads (which are skipped but still count
+# towards the nth() positions)
+BUTTONS_HTML = """
+<!DOCTYPE html>
+<html>
+<body>
+    <button onclick="Download('outside_20241117.gz')">Outside any table</button>
+    <table id="files">
+        <tr><th>File</th><th>Date</th><th></th></tr>
+        <tr>
+            <td>PriceFull7290000000001-001-202411170100.gz</td>
+            <td>17/11/2024 01:00</td>
+            <td><button onclick="Download('PriceFull7290000000001-001-202411170100.gz')">Download</button></td>
+        </tr>
+        <tr>
+            <td>Nested listing</td>
+            <td>
+                <table>
+                    <tr>
+                        <td>Promo7290000000001-001-202411160200.gz</td>
+                        <td>16/11/2024 02:00</td>
+                        <td><button onclick="Download('Promo7290000000001-001-202411160200.gz')">Download</button></td>
+                    </tr>
+                    <tr>
+                        <td>Stores7290000000001-202411150300.zip</td>
+                        <td>15/11/2024 03:00</td>
+                        <td><button onclick="download(&quot;Stores7290000000001-202411150300.zip&quot;)">Download</button></td>
+                    </tr>
+                </table>
+            </td>
+            <td>18/11/2024 09:00</td>
+        </tr>
+        <tr>
+            <td>readme.txt</td>
+            <td>17/11/2024 04:00</td>
+            <td><button onclick="Download('readme.txt')">Download</button></td>
+        </tr>
+        <tr>
+            <td>Price7290000000001-002-202411170500.gz</td>
+            <td>no date</td>
+            <td><button onclick="Download('Price7290000000001-002-202411170500.gz')">Download</button></td>
+        </tr>
+    </table>
+</body>
+</html>
+"""
+
+
+@pytest.mark.asyncio
+async def test_download_buttons_match_nth_locator():
+    """Filename, row date and buttonIndex line up with locator(...).nth()."""
+    from crawler.adapters.bina import _DOWNLOAD_BUTTONS_JS
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        page = await browser.new_page()
+        await page.set_content(BUTTONS_HTML)
+
+        buttons = await page.evaluate(_DOWNLOAD_BUTTONS_JS)
+
+        assert [(b["filename"], b["date"], b["buttonIndex"]) for b in buttons] == [
+            ("PriceFull7290000000001-001-202411170100.gz", "17/11/2024", 1),
+            ("Promo7290000000001-001-202411160200.gz", "16/11/2024", 2),
+            ("Stores7290000000001-202411150300.zip", "15/11/2024", 3),
+            ("Price7290000000001-002-202411170500.gz", None, 5),
+        ]
+
+        # The index must click the very button the filename came from
+        locator = page.locator(BUTTON_SELECTOR)
+        for b in buttons:
+            onclick = await locator.nth(b["buttonIndex"]).get_attribute("onclick")
+            assert onclick == b["onclick"] and b["filename"] in onclick
+
+        await browser.close()
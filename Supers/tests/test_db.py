@@ -0,0 +1,260 @@
+"""Tests for the batch save helpers in crawler.db (no database needed)."""
+from datetime import datetime
+
+import pytest
+
+from crawler.db import (
+    EXACT_SNAPSHOTS_SQL,
+    LATEST_SNAPSHOTS_SQL,
+    SELECT_PRODUCT_IDS_SQL,
+    TOUCH_SNAPSHOTS_SQL,
+    UNNEST_CHUNK_ROWS,
+    _DATE_FORMATS,
+    _conflict_rounds,
+    _debounce_snapshots,
+    _parse_price,
+    _parse_timestamp,
+    _product_upsert_sql,
+    _save_price_snapshots,
+    _upsert_products,
+)
+
+T1 = datetime(2024, 11, 17, 1, 0)
+T2 = datetime(2024, 11, 18, 1, 0)
+
+
+class FakeConn:
+    """Records fetch calls; every upsert row comes back with an id unless listed as unchanged."""
+
+    def __init__(self, unchanged=()):
+        self.unchanged = set(unchanged)
+        self.upserts = []
+        self.selects = []
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def fetch(self, sql, *args):
+        barcodes = args[0]
+        if sql == SELECT_PRODUCT_IDS_SQL:
+            self.selects.append(list(barcodes))
+            return [{"barcode": b, "id": int(b)} for b in barcodes]
+        self.upserts.append((sql, args))
+        return [{"barcode": b, "id": int(b)} for b in barcodes if b not in self.unchanged]
+
+
+class FakeTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_conflict_rounds_unique_keys_per_round():
+    items = [("a", 1), ("b", 1), ("a", 2), ("a", 3), ("c", 1), ("b", 2)]
+    assert _conflict_rounds(items) == [
+        [("a", 1), ("b", 1), ("c", 1)],
+        [("a", 2), ("b", 2)],
+        [("a", 3)],
+    ]
+
+
+def test_conflict_rounds_empty_and_distinct():
+    assert _conflict_rounds([]) == []
+    assert _conflict_rounds([("a",), ("b",)]) == [[("a",), ("b",)]]
+
+
+def test_product_upsert_sql_only_sets_masked_columns():
+    name_only = _product_upsert_sql((False,) * 5)
+    assert "name = " in name_only
+    assert "brand = " not in name_only and '"imageUrl" = ' not in name_only
+
+    brand_and_image = _product_upsert_sql((True, False, False, False, True))
+    assert "brand = " in brand_and_image and '"imageUrl" = ' in brand_and_image
+    assert "quantity = " not in brand_and_image and '"isWeighted" = ' not in brand_and_image
+    # Same text per mask, so the statement cache sees one statement
+    assert _product_upsert_sql((False,) * 5) is name_only
+
+
+@pytest.mark.asyncio
+async def test_upsert_products_merges_duplicate_barcodes():
+    conn = FakeConn()
+    ids = await _upsert_products(conn, [
+        ("2", "Bread", "Angel", 750.0, "g", True, "img.png"),
+        ("1", "Milk", None, None, None, None, None),
+        ("1", None, "Tnuva", 1.0, "", False, None),
+        # Empty values never overwrite what an earlier row had
+        ("2", "", None, None, "", None, ""),
+        ("3", None, None, None, None, None, None),
+    ])
+
+    assert ids == {"1": 1, "2": 2, "3": 3}
+    [(sql, columns)] = conn.upserts
+    rows = list(zip(*columns))
+    assert rows == [
+        ("1", "Milk", "Tnuva", 1.0, None, False, None),
+        ("2", "Bread", "Angel", 750.0, "g", True, "img.png"),
+        ("3", "Unknown (3)", None, None, None, None, None),
+    ]
+    assert sql == _product_upsert_sql((True, True, True, True, True))
+
+
+@pytest.mark.asyncio
+async def test_upsert_products_looks_up_unchanged_rows():
+    conn = FakeConn(unchanged={"2"})
+    ids = await _upsert_products(conn, [("1", "A", None, None, None, None, None),
+                                        ("2", "B", None, None, None, None, None)])
+
+    assert ids == {"1": 1, "2": 2}
+    assert conn.selects == [["2"]]
+
+
+@pytest.mark.asyncio
+async def test_upsert_products_chunks_at_unnest_chunk_rows():
+    products = [(f"{i:05d}", f"P{i}", None, None, None, None, None) for i in range(UNNEST_CHUNK_ROWS + 1)]
+    # Only the row that lands alone in the second chunk has a brand
+    products[-1] = products[-1][:2] + ("Brand",) + products[-1][3:]
+    conn = FakeConn()
+
+    ids = await _upsert_products(conn, list(reversed(products)))
+
+    assert len(ids) == UNNEST_CHUNK_ROWS + 1
+    assert [len(columns[0]) for _, columns in conn.upserts] == [UNNEST_CHUNK_ROWS, 1]
+    first, second = conn.upserts
+    # Chunks follow barcode order, whatever the input order
+    assert list(first[1][0]) == [p[0] for p in products[:UNNEST_CHUNK_ROWS]]
+    assert list(second[1][0]) == [products[-1][0]]
+    # Each chunk's mask only covers its own rows
+    assert first[0] == _product_upsert_sql((False,) * 5)
+    assert second[0] == _product_upsert_sql((True, False, False, False, False))
+    assert conn.selects == []
+
+
+def _latest(product_id, store_id, snapshot_id, price, is_on_sale, timestamp):
+    return {"productId": product_id, "storeId": store_id, "id": snapshot_id,
+            "price": price, "isOnSale": is_on_sale, "timestamp": timestamp}
+
+
+def test_debounce_same_price_touches_latest():
+    touch, insert = _debounce_snapshots(
+        [(0, 1, 10, 5.9, False, T2)], exact=[], latest=[_latest(1, 10, 100, 5.9, False, T1)])
+    assert (touch, insert) == ({100}, [])
+
+
+def test_debounce_changed_price_or_sale_inserts():
+    touch, insert = _debounce_snapshots(
+        [(0, 1, 10, 6.5, False, T2), (1, 2, 10, 5.9, True, T2)],
+        exact=[],
+        latest=[_latest(1, 10, 100, 5.9, False, T1), _latest(2, 10, 200, 5.9, False, T1)],
+    )
+    assert (touch, insert) == (set(), [0, 1])
+
+
+def test_debounce_exact_timestamp_only_touches():
+    touch, insert = _debounce_snapshots(
+        [(0, 1, 10, 9.9, False, T1)], exact=[{"ord": 0, "id": 100}],
+        latest=[_latest(1, 10, 100, 5.9, False, T1)])
+    assert (touch, insert) == ({100}, [])
+
+
+def test_debounce_collapses_in_batch_duplicates():
+    touch, insert = _debounce_snapshots([
+        (0, 1, 10, 5.9, False, T1),
+        # Same product, store and timestamp as row 0
+        (1, 1, 10, 6.9, False, T1),
+        # Same price as row 0, which now counts as the latest snapshot
+        (2, 1, 10, 5.9, False, T2),
+        # Price changed against row 0
+        (3, 1, 10, 7.9, False, T2),
+        # Other store, no history
+        (4, 1, None, 5.9, False, T1),
+    ], exact=[], latest=[])
+    assert (touch, insert) == (set(), [0, 3, 4])
+
+
+class FakeSnapshotConn:
+    """Records what _save_price_snapshots executes and copies; fetches return canned rows."""
+
+    def __init__(self, exact=(), latest=()):
+        self.rows = {EXACT_SNAPSHOTS_SQL: list(exact), LATEST_SNAPSHOTS_SQL: list(latest)}
+        self.executed = []
+        self.copies = []
+
+    async def execute(self, sql, *args):
+        self.executed.append((sql, args))
+
+    async def fetch(self, sql, *args):
+        return self.rows[sql]
+
+    async def copy_records_to_table(self, table, records, columns=None):
+        self.copies.append((table, list(records), columns))
+
+
+@pytest.mark.asyncio
+async def test_save_price_snapshots_stages_rows_then_applies_debounce():
+    snapshots = [
+        (0, 1, 10, 5.9, False, T2),
+        (1, 2, 10, 8.0, True, T2),
+        (2, 3, None, 1.5, False, T1),
+    ]
+    conn = FakeSnapshotConn(
+        exact=[{"ord": 2, "id": 300}],
+        latest=[_latest(1, 10, 100, 5.9, False, T1), _latest(2, 10, 200, 9.0, True, T1)],
+    )
+
+    assert await _save_price_snapshots(conn, 7, snapshots) == 3
+
+    stage, new_rows = conn.copies
+    # Every row is staged as-is, ord first, in the stage table's column order
+    assert stage == ("snapshot_stage", snapshots, None)
+    assert new_rows == (
+        "price_snapshots",
+        [(2, 7, 10, 8.0, True, T2)],
+        ["productId", "retailerId", "storeId", "price", "isOnSale", "timestamp"],
+    )
+    assert conn.executed[-1] == (TOUCH_SNAPSHOTS_SQL, ([100, 300],))
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-11-17T01:02:03", datetime(2024, 11, 17, 1, 2, 3)),
+    ("2024-11-17 01:02:03.000+02:00", datetime(2024, 11, 17, 1, 2, 3)),
+    ("2024-11-17", datetime(2024, 11, 17)),
+    ("17/11/2024 01:02:03", datetime(2024, 11, 17, 1, 2, 3)),
+    ("17/11/2024 01:02", datetime(2024, 11, 17, 1, 2)),
+    ("17/11/2024", datetime(2024, 11, 17)),
+    ("17-11-2024", datetime(2024, 11, 17)),
+    # Day first, never US month first
+    ("01/02/2024", datetime(2024, 2, 1)),
+    ("not a date", None),
+])
+def test_parse_timestamp_formats(value, expected):
+    assert _parse_timestamp(value, list(_DATE_FORMATS)) == expected
+
+
+def test_parse_timestamp_moves_matched_format_first():
+    formats = list(_DATE_FORMATS)
+    assert _parse_timestamp("17-11-2024", formats) == datetime(2024, 11, 17)
+    assert formats[0] == "%d-%m-%Y"
+    assert sorted(formats) == sorted(_DATE_FORMATS)
+    # Still day first for the other layouts once the order changed
+    assert _parse_timestamp("01/02/2024", formats) == datetime(2024, 2, 1)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("12.90", 12.9),
+    (" 5 ", 5.0),
+    (".5", 0.5),
+    ("-1", -1.0),
+    ("7.", 7.0),
+    (3, 3.0),
+    (2.5, 2.5),
+    # Thousands separators, empty and missing values are not prices
+    ("1,234.00", None),
+    ("", None),
+    (None, None),
+    ("N/A", None),
+    ("nan", None),
+])
+def test_parse_price(value, expected):
+    assert _parse_price(value) == expected
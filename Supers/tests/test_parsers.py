@@ -0,0 +1,78 @@
+"""Tests for the streaming price/store XML parsers."""
+from crawler.parsers import parse_prices_xml, parse_stores_xml
+
+
+PRICE_XML = b"""<?xml version="1.0" encoding="utf-8"?>
+<Root>
+    <ChainId>7290027600007</ChainId>
+    <StoreId>004</StoreId>
+    <Items>
+        <Item><ItemCode>111</ItemCode><ItemName>Milk</ItemName><ItemPrice>5.90</ItemPrice></Item>
+        <Item><ItemCode>222</ItemCode><ItemPrice>10</ItemPrice><PromotionPrice>8</PromotionPrice></Item>
+        <Item><ItemCode>333</ItemCode></Item>
+    </Items>
+</Root>
+"""
+
+PROMO_XML = b"""<Root>
+    <StoreId>7</StoreId>
+    <Promotions>
+        <Promotion>
+            <PromotionItems>
+                <Item><ItemCode>1</ItemCode></Item>
+                <Item><ItemCode>2</ItemCode></Item>
+            </PromotionItems>
+            <DiscountedPrice>3</DiscountedPrice>
+        </Promotion>
+        <Promotion>
+            <PromotionItems><Item><ItemCode>3</ItemCode></Item></PromotionItems>
+        </Promotion>
+    </Promotions>
+</Root>
+"""
+
+
+def test_parse_prices_xml_items():
+    rows, meta = parse_prices_xml(PRICE_XML, company="acme")
+
+    assert meta["store_id"] == "004"
+    assert [r["barcode"] for r in rows] == ["111", "222"]
+    assert rows[0]["name"] == "Milk" and rows[0]["is_on_sale"] is False
+    assert rows[1]["price"] == "8" and rows[1]["is_on_sale"] is True
+    assert all(r["store_id"] == "004" for r in rows)
+
+
+def test_parse_prices_xml_promotions():
+    rows, meta = parse_prices_xml(PROMO_XML, company="acme")
+
+    # Promotion without a DiscountedPrice yields no rows
+    assert [r["barcode"] for r in rows] == ["1", "2"]
+    assert all(r["price"] == "3" and r["is_on_sale"] for r in rows)
+    assert all(r["store_id"] == "7" for r in rows)
+
+
+def test_parse_prices_xml_invalid():
+    assert parse_prices_xml(b"<broken", company="acme") == ([], {})
+
+
+def test_parse_stores_xml():
+    xml = b"<Root><Stores><Store><StoreId>1</StoreId><City>Haifa</City></Store><Store><StoreId>2</StoreId></Store></Stores></Root>"
+    rows = parse_stores_xml(xml)
+
+    assert [r["external_id"] for r in rows] == ["1", "2"]
+    assert rows[0]["city"] == "Haifa"
+
+
+def test_parse_prices_xml_from_archive_streams():
+    import gzip, io, zipfile
+    from crawler.archive_utils import iter_xml_streams
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("PriceFull-004.xml", PRICE_XML)
+
+    for blob, hint in ((gzip.compress(PRICE_XML), "PriceFull-004.gz"), (buf.getvalue(), "PriceFull-004.zip")):
+        entries = list((name, parse_prices_xml(stream, company="acme")) for name, stream in iter_xml_streams(blob, hint))
+        assert len(entries) == 1
+        _, (rows, _) = entries[0]
+        assert [r["barcode"] for r in rows] == ["111", "222"]
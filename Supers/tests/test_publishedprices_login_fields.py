@@ -0,0 +1,88 @@
+"""
+Test for the PublishedPrices login control lookup (_LOGIN_FIELDS_JS).
+
+Controls are picked by candidate priority, not by DOM order: a generic match
+earlier in the page must not win over a more specific one further down.
+"""
+import pytest
+from playwright.async_api import async_playwright
+
+
+# Every control's generic candidate comes before its preferred one in the DOM
+LOGIN_HTML = """
+<!DOCTYPE html>
+<html>
+<body>
+    <form id="newsletter">
+        <input type="email" id="newsletter-email">
+        <button id="newsletter-login">Login to subscribe</button>
+    </form>
+    <form id="login">
+        <input type="password" id="pin">
+        <input name="username" id="user">
+        <input name="password" id="pass">
+        <button id="other">Help</button>
+        <button type="submit" id="submit">כניסה</button>
+    </form>
+</body>
+</html>
+"""
+
+# No specific submit control: the first form button is the fallback
+FALLBACK_HTML = """
+<!DOCTYPE html>
+<html>
+<body>
+    <form>
+        <input id="username">
+        <button id="first">Go</button>
+        <button id="second">Reset</button>
+    </form>
+</body>
+</html>
+"""
+
+
+async def _picked(page, html):
+    """Run the lookup on html and return {role: id of the tagged control}."""
+    from crawler.adapters.publishedprices import (
+        _LOGIN_FIELDS_JS, LOGIN_FIELD_SELECTOR,
+        USERNAME_CANDIDATES, PASSWORD_CANDIDATES, SUBMIT_CANDIDATES,
+    )
+
+    await page.set_content(html)
+    found = await page.evaluate(_LOGIN_FIELDS_JS, {
+        "username": USERNAME_CANDIDATES,
+        "password": PASSWORD_CANDIDATES,
+        "submit": SUBMIT_CANDIDATES,
+    })
+    picked = {}
+    for role in found:
+        locator = page.locator(LOGIN_FIELD_SELECTOR % role)
+        assert await locator.count() == 1
+        picked[role] = await locator.get_attribute("id")
+    return picked
+
+
+@pytest.mark.asyncio
+async def test_login_fields_follow_candidate_priority():
+    """The preferred candidate wins even when a generic one comes first in the DOM."""
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        page = await browser.new_page()
+
+        assert await _picked(page, LOGIN_HTML) == {"username": "user", "password": "pass", "submit": "submit"}
+
+        await browser.close()
+
+
+@pytest.mark.asyncio
+async def test_login_fields_fallbacks():
+    """Missing controls are left out; a bare form button is the last submit candidate."""
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        page = await browser.new_page()
+
+        assert await _picked(page, FALLBACK_HTML) == {"username": "username", "submit": "first"}
+
+        await browser.close()